@@ -0,0 +1,52 @@
+"""
+后台事件循环
+在一个常驻线程中运行asyncio事件循环，同步的Flask路由把协程提交给它执行，
+不再为每个请求创建和销毁事件循环；get_id的连接池因此可以跨请求复用，并发查询也能互相重叠
+"""
+
+import asyncio
+import sys
+import threading
+
+
+class BackgroundEventLoop:
+    """运行在独立守护线程中的事件循环"""
+
+    def __init__(self, name="async-loop"):
+        self._loop = asyncio.new_event_loop()
+        self._shutdown_hooks = []
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def add_shutdown_hook(self, hook):
+        """注册关闭时在循环内执行的协程函数（例如关闭共享的HTTP会话）"""
+        self._shutdown_hooks.append(hook)
+
+    def submit(self, coro):
+        """提交协程，返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并等待结果，超时后取消协程并抛出TimeoutError"""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout=5):
+        """执行关闭钩子后停止事件循环"""
+        if not self._loop.is_running():
+            return
+        for hook in self._shutdown_hooks:
+            try:
+                self.run(hook(), timeout=timeout)
+            except Exception as e:
+                print(f"后台事件循环关闭钩子出错: {e}", file=sys.stderr)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,137 @@
+"""
+变体走法的局面转换开销测试
+对比原先重建并重新解析FEN的做法（fen().split -> 拼接 -> set_fen）和GameState的原地修改，
+先确认两者得到相同的局面，再分别测量每次转换的耗时
+
+用法:
+    python bench_board_transitions.py --positions 500 --repeat 20
+"""
+
+import argparse
+import random
+import time
+
+import chess
+
+from game_session import GameState
+
+
+def fen_manual_move(board, from_square, to_square):
+    """原先的特殊走法实现: 移动棋子后重建完整FEN再set_fen"""
+    fen_parts = board.fen().split(' ')
+    piece = board.remove_piece_at(from_square)
+    board.set_piece_at(to_square, piece)
+    active_color = 'b' if fen_parts[1] == 'w' else 'w'
+    fullmove_number = int(fen_parts[5]) + (1 if active_color == 'w' else 0)
+    board.set_fen(f"{board.board_fen()} {active_color} {fen_parts[2]} - {int(fen_parts[4]) + 1} {fullmove_number}")
+    # 原先set_fen之后还要为引擎重新生成一次FEN
+    return board.fen()
+
+
+def fen_set_turn(board, color):
+    """原先的变体E/F回合交还: 改写FEN中的走棋方再set_fen"""
+    fen_parts = board.fen().split(' ')
+    fen_parts[1] = 'w' if color == chess.WHITE else 'b'
+    board.set_fen(' '.join(fen_parts))
+    return board.fen()
+
+
+def random_positions(count, seed):
+    """随机对局中途的局面，以及每个局面上一个可以直接移动的棋子和空的目标格"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        board = chess.Board()
+        for _ in range(rng.randrange(4, 60)):
+            moves = list(board.legal_moves)
+            if not moves:
+                break
+            board.push(rng.choice(moves))
+        movers = list(chess.SquareSet(board.occupied_co[board.turn] & ~board.kings))
+        empty = list(chess.SquareSet(chess.BB_ALL & ~board.occupied))
+        if movers and empty:
+            positions.append((board, rng.choice(movers), rng.choice(empty)))
+    return positions
+
+
+def make_game(board):
+    game = GameState("bench")
+    game.board = board.copy()
+    return game
+
+
+def check_equivalent(positions):
+    for board, from_square, to_square in positions:
+        game = make_game(board)
+        game.apply_manual_move(from_square, to_square)
+        expected = fen_manual_move(board.copy(), from_square, to_square)
+        assert game.board.fen() == expected, (board.fen(), from_square, to_square)
+        assert len(game.board.move_stack) == len(board.move_stack)
+
+        game = make_game(board)
+        game.set_turn(not board.turn)
+        assert game.board.fen() == fen_set_turn(board.copy(), not board.turn), board.fen()
+
+
+def timed(label, positions, repeat, fn):
+    """每次转换的平均耗时（微秒），棋盘复制的时间不计入"""
+    total = 0.0
+    for _ in range(repeat):
+        for board, from_square, to_square in positions:
+            target = fn.prepare(board)
+            start = time.perf_counter()
+            fn(target, board, from_square, to_square)
+            total += time.perf_counter() - start
+    per_call = total / (repeat * len(positions)) * 1e6
+    print(f"{label:<28}{per_call:>10.2f} 微秒")
+    return per_call
+
+
+def transition(prepare):
+    def decorator(fn):
+        fn.prepare = prepare
+        return fn
+    return decorator
+
+
+@transition(lambda board: board.copy())
+def old_manual_move(target, board, from_square, to_square):
+    fen_manual_move(target, from_square, to_square)
+
+
+@transition(make_game)
+def new_manual_move(target, board, from_square, to_square):
+    target.apply_manual_move(from_square, to_square)
+
+
+@transition(lambda board: board.copy())
+def old_set_turn(target, board, from_square, to_square):
+    fen_set_turn(target, not board.turn)
+
+
+@transition(make_game)
+def new_set_turn(target, board, from_square, to_square):
+    target.set_turn(not board.turn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="变体走法局面转换: FEN重建与原地修改的耗时对比")
+    parser.add_argument("--positions", type=int, default=500, help="测试的随机局面数")
+    parser.add_argument("--repeat", type=int, default=20, help="每个局面重复的次数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    positions = random_positions(args.positions, args.seed)
+    check_equivalent(positions)
+    print(f"{len(positions)} 个局面上两种做法得到的局面一致")
+
+    old = timed("特殊走法 (FEN重建)", positions, args.repeat, old_manual_move)
+    new = timed("特殊走法 (原地修改)", positions, args.repeat, new_manual_move)
+    print(f"{'':<28}节省 {old - new:.2f} 微秒/步 ({old / new:.1f}x)")
+    old = timed("交还回合 (FEN重建)", positions, args.repeat, old_set_turn)
+    new = timed("交还回合 (原地修改)", positions, args.repeat, new_set_turn)
+    print(f"{'':<28}节省 {old - new:.2f} 微秒/次 ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Twitter资料查询压测
+启动一个本地模拟的Twitter API服务器，把get_id指向它，测量并发查询的吞吐量和延迟
+
+用法:
+    python bench_twitter_lookup.py --requests 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import time
+
+from aiohttp import web
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def create_stub_app(latency_ms, token_limit=1000, window=900):
+    """模拟guest token和UserByScreenName接口，每个响应延迟latency_ms毫秒
+
+    每个guest token在window秒的窗口内最多允许token_limit次查询，超出后返回429
+    """
+    usage = {}
+    app_stats = {'activations': 0, 'lookups': 0, 'rate_limited': 0}
+
+    async def activate(request):
+        await asyncio.sleep(latency_ms / 1000)
+        app_stats['activations'] += 1
+        token = f"stub-token-{app_stats['activations']}"
+        usage[token] = [0, time.time() + window]
+        return web.json_response({"guest_token": token})
+
+    async def user_by_screen_name(request):
+        await asyncio.sleep(latency_ms / 1000)
+        app_stats['lookups'] += 1
+        window_usage = usage.setdefault(request.headers.get("x-guest-token"), [0, time.time() + window])
+        if time.time() >= window_usage[1]:
+            window_usage[:] = [0, time.time() + window]
+        window_usage[0] += 1
+        headers = {
+            "x-rate-limit-remaining": str(max(0, token_limit - window_usage[0])),
+            "x-rate-limit-reset": str(int(window_usage[1])),
+        }
+        if window_usage[0] > token_limit:
+            app_stats['rate_limited'] += 1
+            return web.json_response({"errors": [{"message": "Rate limit exceeded"}]}, status=429, headers=headers)
+        return web.json_response({
+            "data": {"user": {"result": {"rest_id": "1", "legacy": {"screen_name": "stub", "followers_count": 1}}}}
+        }, headers=headers)
+
+    app = web.Application()
+    app['stats'] = app_stats
+    app.router.add_post("/1.1/guest/activate.json", activate)
+    app.router.add_get("/graphql/{query_id}/UserByScreenName", user_by_screen_name)
+    return app
+
+
+async def run_benchmark(get_id, total, concurrency):
+    latencies = []
+    limiter = asyncio.Semaphore(concurrency)
+
+    async def lookup(i):
+        async with limiter:
+            start = time.perf_counter()
+            result = await get_id.get_twitter_user_id(f"user{i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+            return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(lookup(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    await get_id.close_session()
+
+    failed = sum(1 for r in results if not r or 'data' not in r)
+    latencies.sort()
+    print(f"请求数: {total}, 并发: {concurrency}, 失败: {failed}")
+    print(f"总用时: {elapsed:.2f} 秒, 吞吐量: {total / elapsed:.1f} 次/秒")
+    print(f"延迟 p50: {statistics.median(latencies):.1f} 毫秒, "
+          f"p95: {latencies[int(len(latencies) * 0.95) - 1]:.1f} 毫秒")
+
+
+async def main(args):
+    app = create_stub_app(args.latency_ms, token_limit=args.token_limit)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    os.environ["TWITTER_API_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ.setdefault("TWITTER_MAX_CONCURRENCY", str(args.concurrency))
+    # get_id在导入时读取API地址
+    import get_id
+
+    try:
+        await run_benchmark(get_id, args.requests, args.concurrency)
+        print(f"模拟服务器: {app['stats']}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Twitter资料查询压测（本地模拟服务器）")
+    parser.add_argument("--requests", type=int, default=500, help="查询次数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发查询数")
+    parser.add_argument("--token-limit", type=int, default=1000, help="每个guest token在15分钟窗口内允许的查询数")
+    parser.add_argument("--latency-ms", type=float, default=20, help="模拟服务器每个响应的延迟（毫秒）")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,117 @@
+"""
+变体规则层的单步开销测试
+用一个立即返回的模拟引擎代替Stockfish，逐个变体对局，测量每步中变体规则层（不含引擎时间）的耗时
+
+用法:
+    python bench_variant_rules.py --moves 2000 --rank G
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+import chess
+
+from game_session import GameState
+from variant_rules import RULES, VariantEngine
+
+
+class InstantEngine:
+    """模拟引擎: 在收到的局面中随机选一个合法走法，记录自身耗时以便从总时间中扣除"""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.board = chess.Board()
+        self.elapsed = 0.0
+
+    def set_position(self, fen=None, moves=None):
+        start = time.perf_counter()
+        self.board = chess.Board(fen) if fen else chess.Board()
+        for move in moves or []:
+            self.board.push_uci(move)
+        self.elapsed += time.perf_counter() - start
+
+    def _result(self, moves):
+        return {
+            'bestmove': self.rng.choice(moves).uci() if moves else None,
+            'evaluation': {'type': 'cp', 'value': 0},
+            'pv': [],
+            'depth': 1,
+        }
+
+    def search(self):
+        start = time.perf_counter()
+        result = self._result(list(self.board.legal_moves))
+        self.elapsed += time.perf_counter() - start
+        return result
+
+    def search_excluding(self, excluded_from_squares):
+        start = time.perf_counter()
+        excluded = {chess.parse_square(name) for name in excluded_from_squares}
+        result = self._result([m for m in self.board.legal_moves if m.from_square not in excluded])
+        self.elapsed += time.perf_counter() - start
+        return result
+
+    def get_evaluation(self):
+        return {'type': 'cp', 'value': 0}
+
+
+def run_variant(variant, moves, rank, random_move_probability, seed):
+    """按变体连续对局，返回 (每步规则层耗时列表（微秒）, 各效果触发次数)"""
+    engine = VariantEngine()
+    stockfish = InstantEngine(seed)
+    player = random.Random(seed + 1)
+    samples = []
+    effects = {}
+
+    game = None
+    games = 0
+    while len(samples) < moves:
+        if game is None or game.board.is_game_over() or not any(game.board.legal_moves):
+            game = GameState(f"bench-{variant}")
+            # 每局使用固定的种子，两次运行触发的变体效果完全相同
+            game.seed_rng(seed + games)
+            games += 1
+            game.chess_variant_state = variant
+            game.random_move_probability = random_move_probability
+            game.current_match_info['user_rank'] = rank
+
+        move = player.choice(list(game.board.legal_moves))
+        stockfish.elapsed = 0.0
+        start = time.perf_counter()
+        ctx = engine.play_turn(game, move, stockfish)
+        engine.response(ctx)
+        samples.append((time.perf_counter() - start - stockfish.elapsed) * 1e6)
+
+        for effect in (ctx.effect, 'transform' if ctx.transform_square is not None else None):
+            if effect:
+                effects[effect] = effects.get(effect, 0) + 1
+    return samples, effects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="变体规则层的单步开销（不含引擎时间）")
+    parser.add_argument("--moves", type=int, default=2000, help="每个变体测量的步数")
+    parser.add_argument("--rank", default="G", help="用户评级，决定各变体效果的触发概率")
+    parser.add_argument("--random-move-probability", type=float, default=0.38, help="随机走位概率")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'变体':<8}{'p50(微秒)':>12}{'p99(微秒)':>12}{'平均(微秒)':>12}  触发的效果")
+    for variant in RULES:
+        if variant in ('A', 'B', 'C'):
+            # A/B/C只影响variant_move请求，常规走法与normal相同
+            continue
+        samples, effects = run_variant(variant, args.moves, args.rank, args.random_move_probability, args.seed)
+        samples.sort()
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"{variant:<8}{statistics.median(samples):>12.1f}{p99:>12.1f}{statistics.mean(samples):>12.1f}  {effects}")
+
+
+if __name__ == "__main__":
+    # 变体效果的日志写到stderr，测试时不输出
+    sys.stderr = open(os.devnull, "w")
+    main()
@@ -0,0 +1,99 @@
+"""
+离线生成开局库
+从初始局面开始广度优先展开，用Stockfish的MultiPV分析每个局面，把候选走法按与最佳走法的差距加权写入Polyglot文件
+
+用法:
+    python build_opening_book.py --plies 8 --multipv 4 --depth 18 --output opening_book.bin
+"""
+
+import argparse
+import math
+import sys
+from collections import deque
+
+import chess
+import chess.polyglot
+
+from opening_book import encode_learn, encode_move, write_book
+from stockfish_wrapper import StockfishWrapper
+
+
+def pov_score(evaluation, white_to_move):
+    """把白方视角的评估换算成走棋方视角的厘兵分数"""
+    if evaluation['type'] == 'mate':
+        cp = 100000 if evaluation['value'] > 0 else -100000
+    else:
+        cp = evaluation['value']
+    return cp if white_to_move else -cp
+
+
+def build_book(engine, plies, max_loss, max_positions):
+    """广度优先展开开局树
+
+    Returns:
+        (key, move_code, weight, learn) 列表
+    """
+    entries = []
+    seen = set()
+    frontier = deque([chess.Board()])
+
+    while frontier and len(seen) < max_positions:
+        board = frontier.popleft()
+        key = chess.polyglot.zobrist_hash(board)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        engine.set_position(fen=board.fen())
+        result = engine.search()
+        if not result['lines']:
+            continue
+
+        best = pov_score(result['lines'][0]['evaluation'], board.turn == chess.WHITE)
+        for line in result['lines']:
+            loss = best - pov_score(line['evaluation'], board.turn == chess.WHITE)
+            if loss > max_loss:
+                continue
+
+            move = chess.Move.from_uci(line['move'])
+            weight = max(1, round(1000 * math.exp(-loss / 50)))
+            entries.append((key, encode_move(board, move), weight, encode_learn(line['evaluation'])))
+
+            if board.ply() + 1 < plies:
+                child = board.copy(stack=False)
+                child.push(move)
+                frontier.append(child)
+
+        print(f"已分析 {len(seen)} 个局面，共 {len(entries)} 条", file=sys.stderr)
+
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用Stockfish离线生成Polyglot开局库")
+    parser.add_argument("--output", default="opening_book.bin", help="输出文件路径")
+    parser.add_argument("--plies", type=int, default=8, help="展开的半回合数")
+    parser.add_argument("--multipv", type=int, default=4, help="每个局面保留的候选走法数")
+    parser.add_argument("--depth", type=int, default=18, help="分析深度")
+    parser.add_argument("--max-loss", type=int, default=80, help="候选走法与最佳走法的最大分差(厘兵)")
+    parser.add_argument("--max-positions", type=int, default=20000, help="最多分析的局面数")
+    parser.add_argument("--stockfish", default=None, help="Stockfish可执行文件路径")
+    args = parser.parse_args()
+
+    engine = StockfishWrapper(path=args.stockfish, depth=args.depth, parameters={
+        "Threads": 4,
+        "Hash": 256,
+        "Skill Level": 20,
+        "MultiPV": args.multipv
+    })
+    try:
+        entries = build_book(engine, args.plies, args.max_loss, args.max_positions)
+    finally:
+        engine.quit()
+
+    write_book(args.output, entries)
+    print(f"开局库已写入 {args.output}，共 {len(entries)} 条", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
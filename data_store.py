@@ -0,0 +1,181 @@
+"""
+Twitter资料和比赛记录的存储
+使用WAL模式的SQLite，取代工作目录下每个用户/每场比赛一个的 twitter_data_*.json 和 match_data_*.json 文件；
+旧文件可以用 migrate_json_store.py 导入
+"""
+
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS twitter_profiles (
+    username TEXT PRIMARY KEY COLLATE NOCASE,
+    user_rank TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    twitter_user TEXT NOT NULL COLLATE NOCASE,
+    match_start_time REAL NOT NULL,
+    variant TEXT,
+    player_side TEXT,
+    user_rank TEXT,
+    data TEXT NOT NULL
+);
+
+-- 同一用户同一时刻只有一场比赛，重复导入旧文件时据此去重
+CREATE UNIQUE INDEX IF NOT EXISTS idx_matches_user_start ON matches (twitter_user, match_start_time);
+CREATE INDEX IF NOT EXISTS idx_matches_start ON matches (match_start_time);
+"""
+
+
+class DataStore:
+    """线程安全的SQLite存储
+
+    每个线程使用自己的连接，WAL模式下读操作不会被写操作阻塞；写操作串行执行
+    """
+
+    # fsync策略，对应SQLite的PRAGMA synchronous:
+    # FULL每次提交都fsync；NORMAL（默认）在WAL检查点时fsync，断电可能丢失最近的提交但不会损坏数据库；OFF不主动fsync
+    SYNC_MODES = ('OFF', 'NORMAL', 'FULL')
+
+    def __init__(self, path="vibechess.db", synchronous="NORMAL"):
+        synchronous = synchronous.upper()
+        if synchronous not in self.SYNC_MODES:
+            raise ValueError(f"未知的fsync策略: {synchronous}，可选 {', '.join(self.SYNC_MODES)}")
+        self.path = path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        with self._write_lock:
+            self._connection().executescript(SCHEMA)
+        print(f"已打开数据库: {path}", file=sys.stderr)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    def write_batch(self, profiles=(), matches=()):
+        """在一个事务中写入多条资料和比赛记录
+
+        Args:
+            profiles: (username, data) 列表
+            matches: 比赛信息字典列表
+
+        Returns:
+            实际新增的比赛记录数（重复的记录被忽略）
+        """
+        now = time.time()
+        profile_rows = [
+            (username, data.get('user_rank'), json.dumps(data, ensure_ascii=False), now)
+            for username, data in profiles
+        ]
+        match_rows = [
+            (
+                match['twitter_user'],
+                match['match_start_time'],
+                match.get('variant'),
+                match.get('player_side'),
+                match.get('user_rank'),
+                json.dumps(match, ensure_ascii=False),
+            )
+            for match in matches
+        ]
+
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO twitter_profiles (username, user_rank, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(username) DO UPDATE SET user_rank = excluded.user_rank, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    profile_rows
+                )
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO matches "
+                    "(twitter_user, match_start_time, variant, player_side, user_rank, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    match_rows
+                )
+                inserted = conn.total_changes - before
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return inserted
+
+    def put_profile(self, username, data):
+        self.write_batch(profiles=[(username, data)])
+
+    def add_match(self, match):
+        self.write_batch(matches=[match])
+
+    def get_profile(self, username):
+        """返回保存的精简资料，不存在时返回None"""
+        row = self._connection().execute(
+            "SELECT data FROM twitter_profiles WHERE username = ?", (username,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def iter_matches(self, limit, before=None, twitter_user=None, variant=None, player_side=None):
+        """按开始时间倒序逐条返回比赛记录，使用索引做游标分页，不会一次读出全部记录
+
+        Args:
+            limit: 最多返回的记录数
+            before: 游标 (match_start_time, id)，只返回排在它之后的记录
+            twitter_user, variant, player_side: 可选的过滤条件
+
+        Yields:
+            (id, match_start_time, 比赛信息字典)
+        """
+        where, params = self._match_filters(twitter_user, variant, player_side)
+        if before is not None:
+            where.append("(match_start_time, id) < (?, ?)")
+            params.extend(before)
+
+        sql = "SELECT id, match_start_time, data FROM matches"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY match_start_time DESC, id DESC LIMIT ?"
+        params.append(limit)
+
+        for row in self._connection().execute(sql, params):
+            yield row['id'], row['match_start_time'], json.loads(row['data'])
+
+    def count_matches(self, twitter_user=None, variant=None, player_side=None):
+        where, params = self._match_filters(twitter_user, variant, player_side)
+        sql = "SELECT COUNT(*) FROM matches"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._connection().execute(sql, params).fetchone()[0]
+
+    @staticmethod
+    def _match_filters(twitter_user, variant, player_side):
+        where, params = [], []
+        for column, value in (('twitter_user', twitter_user), ('variant', variant), ('player_side', player_side)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        return where, params
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'path': self.path,
+            'synchronous': self.synchronous,
+            'profiles': conn.execute("SELECT COUNT(*) FROM twitter_profiles").fetchone()[0],
+            'matches': conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0],
+        }
@@ -0,0 +1,196 @@
+"""
+Stockfish引擎代理
+gunicorn主进程在fork worker之前启动一个代理进程，由它启动并预热引擎池；
+各worker通过Unix socket向代理借用引擎，不再各自启动Stockfish、分配哈希表
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from multiprocessing.connection import Client, Listener
+
+from engine_pool import LatencyBudgetExceeded
+
+# 允许worker远程调用的引擎方法
+REMOTE_METHODS = {
+    'set_position',
+    'search',
+    'search_excluding',
+    'get_best_move',
+    'get_evaluation',
+    'set_skill_level',
+    'set_option',
+}
+
+
+class EngineBrokerError(Exception):
+    """代理返回的错误"""
+
+
+class EngineBroker:
+    """在独立进程中持有EnginePool，为每个连接借出一个引擎"""
+
+    def __init__(self, address, pool, authkey=b""):
+        self.address = address
+        self.pool = pool
+        self.authkey = authkey
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with Listener(self.address, family='AF_UNIX', authkey=self.authkey) as listener:
+            print(f"Stockfish引擎代理已启动: {self.address}", file=sys.stderr)
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"引擎代理接受连接失败: {e}", file=sys.stderr)
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        """处理一个连接: 第一条消息决定是查询状态还是借出引擎，借出的引擎在连接关闭时归还"""
+        try:
+            kind, options = conn.recv()
+            if kind == 'stats':
+                conn.send(('ok', self.pool.stats()))
+                return
+            if kind != 'checkout':
+                conn.send(('error', f"未知请求: {kind}"))
+                return
+
+            try:
+                with self.pool.checkout(**options) as engine:
+                    conn.send(('ok', None))
+                    self._serve_calls(conn, engine)
+            except LatencyBudgetExceeded as e:
+                conn.send(('budget_exceeded', str(e)))
+            except TimeoutError as e:
+                conn.send(('error', str(e)))
+        except EOFError:
+            pass
+        except Exception as e:
+            print(f"引擎代理处理连接出错: {e}", file=sys.stderr)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _serve_calls(conn, engine):
+        while True:
+            try:
+                name, args, kwargs = conn.recv()
+            except EOFError:
+                return
+            if name not in REMOTE_METHODS:
+                conn.send(('error', f"不允许调用的方法: {name}"))
+                continue
+            try:
+                conn.send(('ok', getattr(engine, name)(*args, **kwargs)))
+            except Exception as e:
+                conn.send(('error', f"{type(e).__name__}: {e}"))
+
+
+class RemoteEngine:
+    """worker一侧的引擎代理对象，接口与StockfishWrapper相同"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if name not in REMOTE_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self._conn.send((name, args, kwargs))
+            status, result = self._conn.recv()
+            if status != 'ok':
+                raise EngineBrokerError(result)
+            return result
+
+        return call
+
+
+class RemoteEnginePool:
+    """worker一侧的引擎池，接口与EnginePool相同，引擎实际运行在代理进程中"""
+
+    def __init__(self, address, authkey=""):
+        self.address = address
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        # 连接一次代理，确认其可用并取得池大小
+        self.size = self.stats()['size']
+
+    def _connect(self):
+        return Client(self.address, family='AF_UNIX', authkey=self.authkey)
+
+    @contextmanager
+    def checkout(self, skill_level=None, budget_ms=None):
+        conn = self._connect()
+        try:
+            conn.send(('checkout', {'skill_level': skill_level, 'budget_ms': budget_ms}))
+            status, result = conn.recv()
+            if status == 'budget_exceeded':
+                raise LatencyBudgetExceeded(result)
+            if status != 'ok':
+                raise TimeoutError(result)
+            yield RemoteEngine(conn)
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            conn.send(('stats', None))
+            status, result = conn.recv()
+            if status != 'ok':
+                raise EngineBrokerError(result)
+            result['broker'] = self.address
+            return result
+        finally:
+            conn.close()
+
+    def warm_up(self):
+        """引擎已在代理进程中预热"""
+
+    def close(self):
+        """引擎由代理进程管理"""
+
+
+def _run_broker(address, authkey):
+    from engine_pool import create_engine_pool_from_env
+
+    pool = create_engine_pool_from_env()
+    pool.warm_up()
+    try:
+        EngineBroker(address, pool, authkey=authkey).serve_forever()
+    finally:
+        pool.close()
+
+
+def start_broker_process(address, authkey, ready_timeout=120):
+    """启动代理进程，等待其可以接受连接后返回进程对象"""
+    process = multiprocessing.Process(
+        target=_run_broker,
+        args=(address, authkey),
+        name="stockfish-broker",
+        daemon=True
+    )
+    process.start()
+
+    pool = None
+    deadline = ready_timeout * 10
+    for _ in range(deadline):
+        if not process.is_alive():
+            raise RuntimeError("Stockfish引擎代理进程启动失败")
+        try:
+            pool = RemoteEnginePool(address, authkey=authkey)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            process.join(0.1)
+    if pool is None:
+        process.terminate()
+        raise TimeoutError(f"等待Stockfish引擎代理启动超时 ({ready_timeout}秒)")
+
+    print(f"Stockfish引擎代理已就绪，共 {pool.size} 个预热的引擎", file=sys.stderr)
+    return process
@@ -0,0 +1,191 @@
+"""
+Stockfish引擎进程池
+每个请求从池中借出一个独立的引擎进程，用完后归还，避免多个棋局共享同一个进程
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from game_session import DEFAULT_SKILL_LEVEL
+from opening_book import OpeningBook
+from search_cache import SearchCache
+from stockfish_wrapper import StockfishWrapper
+
+
+class LatencyBudgetExceeded(TimeoutError):
+    """等待空闲引擎时用完了请求的延迟预算"""
+
+
+class EnginePool:
+    """固定大小的StockfishWrapper池"""
+
+    def __init__(self, size=2, depth=15, parameters=None, path=None, checkout_timeout=30, cache=None, book=None,
+                 health_check_interval=30, ping_timeout=5):
+        """
+        Args:
+            size: 池中引擎进程数量
+            depth: 搜索深度
+            parameters: 每个引擎的参数字典
+            path: Stockfish可执行文件路径，None时自动查找
+            checkout_timeout: 借出引擎的最长等待时间（秒）
+            cache: 所有引擎共享的SearchCache
+            book: 所有引擎共享的OpeningBook
+            health_check_interval: 后台健康检查的间隔（秒），0表示不启动健康检查线程
+            ping_timeout: 健康检查时等待readyok的时间（秒）
+        """
+        if size < 1:
+            raise ValueError("引擎池大小必须至少为1")
+
+        self.size = size
+        self.depth = depth
+        self.parameters = dict(parameters or {})
+        self.path = path
+        self.checkout_timeout = checkout_timeout
+        self.cache = cache
+        self.book = book
+        self.health_check_interval = health_check_interval
+        self.ping_timeout = ping_timeout
+
+        # 健康检查指标
+        self.health_checks = 0
+        self.failed_health_checks = 0
+
+        self._idle = queue.LifoQueue()
+        self._engines = []
+        self._lock = threading.Lock()
+
+        for i in range(size):
+            print(f"启动引擎池中的第 {i + 1}/{size} 个Stockfish进程", file=sys.stderr)
+            engine = StockfishWrapper(path=path, depth=depth, parameters=dict(self.parameters), cache=cache, book=book)
+            self._engines.append(engine)
+            self._idle.put(engine)
+
+        self._closed = threading.Event()
+        if health_check_interval:
+            self._supervisor = threading.Thread(target=self._supervise, name="engine-supervisor", daemon=True)
+            self._supervisor.start()
+
+    @contextmanager
+    def checkout(self, skill_level=None, budget_ms=None):
+        """借出一个引擎，离开with块时自动归还
+
+        Args:
+            skill_level: 该次请求使用的技能等级，与引擎当前设置不同时才会发送setoption
+            budget_ms: 该次请求的延迟预算（毫秒），包含等待空闲引擎的时间；None表示只按深度搜索
+
+        Raises:
+            LatencyBudgetExceeded: 在延迟预算内没有等到空闲引擎
+            TimeoutError: 在checkout_timeout内没有等到空闲引擎
+        """
+        start_time = time.monotonic()
+        timeout = self.checkout_timeout
+        if budget_ms is not None:
+            timeout = min(timeout, budget_ms / 1000)
+        try:
+            engine = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            if timeout < self.checkout_timeout:
+                raise LatencyBudgetExceeded(f"等待空闲Stockfish引擎时超出延迟预算 ({budget_ms:g}毫秒)")
+            raise TimeoutError(f"等待空闲Stockfish引擎超时 ({self.checkout_timeout}秒)")
+
+        try:
+            if not engine.is_alive():
+                engine.restart("借出时发现引擎进程已退出")
+            if skill_level is not None and engine.parameters.get("Skill Level") != skill_level:
+                engine.set_skill_level(skill_level)
+            if budget_ms is not None:
+                engine.request_deadline = start_time + budget_ms / 1000
+            yield engine
+        finally:
+            engine.request_deadline = None
+            self._idle.put(engine)
+
+    def _supervise(self):
+        """后台健康检查: 定期向空闲引擎发送isready，进程已退出或不再响应时重启"""
+        while not self._closed.wait(self.health_check_interval):
+            # 只检查当前空闲的引擎，正在使用的引擎由search自身的重试逻辑处理
+            for _ in range(self._idle.qsize()):
+                try:
+                    engine = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    self.check_health(engine)
+                finally:
+                    self._idle.put(engine)
+
+    def check_health(self, engine):
+        """检查单个引擎，必要时重启，返回检查前引擎是否健康"""
+        self.health_checks += 1
+        if engine.ping(timeout=self.ping_timeout):
+            return True
+
+        self.failed_health_checks += 1
+        try:
+            engine.restart("健康检查失败" if engine.is_alive() else "健康检查发现引擎进程已退出")
+        except Exception as e:
+            print(f"重启Stockfish引擎失败: {e}", file=sys.stderr)
+        return False
+
+    def warm_up(self):
+        """预热池中所有引擎"""
+        for engine in self._engines:
+            engine.warm_up()
+
+    def stats(self):
+        stats = {
+            'size': self.size,
+            'idle': self._idle.qsize(),
+            'restarts': sum(engine.restart_count for engine in self._engines),
+            'health_checks': self.health_checks,
+            'failed_health_checks': self.failed_health_checks,
+            'engines': [
+                {
+                    'alive': engine.is_alive(),
+                    'restarts': engine.restart_count,
+                    'last_restart_reason': engine.last_restart_reason,
+                    'last_restart_time': engine.last_restart_time,
+                }
+                for engine in self._engines
+            ],
+        }
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        if self.book is not None:
+            stats['book'] = self.book.stats()
+        return stats
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for engine in self._engines:
+                engine.quit()
+            self._engines = []
+
+
+def create_engine_pool_from_env():
+    """按环境变量配置创建引擎池（Web进程和引擎代理进程共用）"""
+    # 所有引擎共享的搜索结果缓存，设置SEARCH_CACHE_PATH后重启时可以恢复
+    search_cache = SearchCache(
+        max_entries=int(os.getenv("SEARCH_CACHE_SIZE", "10000")),
+        path=os.getenv("SEARCH_CACHE_PATH") or None
+    )
+    # 开局库（由build_opening_book.py生成），文件不存在时直接使用Stockfish搜索
+    opening_book_path = os.getenv("OPENING_BOOK_PATH", "opening_book.bin")
+    opening_book = OpeningBook(opening_book_path) if os.path.exists(opening_book_path) else None
+    return EnginePool(
+        size=int(os.getenv("STOCKFISH_POOL_SIZE", "2")),
+        depth=15,
+        cache=search_cache,
+        book=opening_book,
+        health_check_interval=float(os.getenv("STOCKFISH_HEALTH_CHECK_INTERVAL", "30")),
+        parameters={
+            "Threads": int(os.getenv("STOCKFISH_THREADS", "2")),
+            "Hash": 32,
+            "Skill Level": DEFAULT_SKILL_LEVEL
+        }
+    )
@@ -0,0 +1,275 @@
+"""
+按会话隔离的棋局状态存储
+每个玩家（通过cookie或game_id标识）拥有独立的棋盘和变体状态，避免并发玩家互相覆盖棋局
+"""
+
+import random
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import chess
+
+from move_log import MoveLog
+
+# 默认随机走动概率
+DEFAULT_RANDOM_MOVE_PROBABILITY = 0.5
+
+# 默认技能等级
+DEFAULT_SKILL_LEVEL = 5
+
+
+class GameState:
+    """单局棋的全部状态"""
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        # 同一局棋的请求需要串行处理
+        self.lock = threading.RLock()
+        self.last_access = time.time()
+
+        self.board = chess.Board()
+        self.skill_level = DEFAULT_SKILL_LEVEL
+
+        # 发送给引擎的局面: 起始FEN(None表示标准初始局面) + 之后的走法列表
+        # 正常走棋只追加走法，引擎因此能看到完整历史用于重复局面判断；
+        # 变体效果直接修改棋盘后，改为以当前FEN为新的起点
+        self.engine_root_fen = None
+        self.engine_moves = []
+
+        # 'A': 兵可以斜着走一格, 'B': 象可以走直线一格, 'D'...'G': 见backend.py中的变体说明, 'normal': 常规规则
+        self.chess_variant_state = 'normal'
+        self.random_move_probability = DEFAULT_RANDOM_MOVE_PROBABILITY
+        self.current_match_info = {
+            'twitter_user': '',
+            'user_rank': '',
+            'random_move_probability': self.random_move_probability,
+            'random_move_level': 0
+        }
+        # 当前对局的走法记录（见move_log.py），未开启记录时为None
+        self.move_log = None
+        # 变体规则的全部随机性（随机走位、D/E/F/G的触发判定、变体G的重生位置）都来自这个随机数序列，
+        # 相同的种子和相同的走法得到完全相同的对局
+        self.rng = random.Random()
+        self.rng_seed = None
+        self.seed_rng()
+        self.reset_variant_tracking()
+
+    def seed_rng(self, seed=None):
+        """重新设置本局随机数序列的种子，seed为None时随机生成一个
+
+        Returns:
+            实际使用的种子
+        """
+        if seed is None:
+            seed = secrets.randbits(63)
+        self.rng_seed = int(seed)
+        self.rng.seed(self.rng_seed)
+        return self.rng_seed
+
+    def reset_variant_tracking(self):
+        """重置每局棋中变体规则的跟踪状态"""
+        # 被冻结棋子的坐标
+        self.frozen_piece_square = None
+        # 当前回合是否是连续走棋触发的额外回合
+        self.is_bonus_move_round = False
+        # 获得连续走棋机会的特定棋子位置
+        self.bonus_move_piece_square = None
+        # 变体G的触发次数
+        self.variant_g_transform_count = 0
+
+    def reset_board(self):
+        """恢复初始局面"""
+        self.board.reset()
+        self.engine_root_fen = None
+        self.engine_moves = []
+
+    def push_move(self, move):
+        """走一步标准走法，同时记录到引擎走法列表
+
+        Args:
+            move: chess.Move 或 UCI字符串
+        """
+        if isinstance(move, str):
+            move = self.board.push_uci(move)
+        else:
+            self.board.push(move)
+        self.engine_moves.append(move.uci())
+        return move
+
+    def set_fen(self, fen):
+        """直接设置局面，之后发给引擎的局面以该FEN为起点"""
+        self.board.set_fen(fen)
+        self.rebase_engine_position()
+
+    def remove_piece(self, square):
+        """移除square上的棋子（变体D自爆）并返回它
+
+        chess.Board的remove_piece_at/set_piece_at会清空走法历史，这里改用BaseBoard的同名方法只修改棋子位置，
+        之前push的每一步仍可pop恢复，python-chess的重复局面判断也能看到完整历史
+        """
+        piece = chess.BaseBoard.remove_piece_at(self.board, square)
+        if piece is not None:
+            self._drop_castling_rights(square, piece)
+            self.rebase_engine_position()
+        return piece
+
+    def place_piece(self, square, piece):
+        """在square上放置棋子（变体G重生），不清空走法历史"""
+        chess.BaseBoard.set_piece_at(self.board, square, piece)
+        self.rebase_engine_position()
+
+    def apply_manual_move(self, from_square, to_square):
+        """不经过标准规则，直接把棋子从from_square移到to_square并交换走棋方（变体特殊走法）
+
+        直接修改棋盘状态，不重建FEN，也不清空走法历史（见remove_piece）: 吃过路兵格清空，半回合计数加一，
+        黑方走完后回合数加一；易位权去掉因这步失效的部分
+
+        Returns:
+            被移动的棋子，起始格没有棋子时返回None且不修改棋盘
+        """
+        board = self.board
+        piece = chess.BaseBoard.remove_piece_at(board, from_square)
+        if piece is None:
+            return None
+        chess.BaseBoard.set_piece_at(board, to_square, piece)
+        self._drop_castling_rights(from_square, piece)
+        self._drop_castling_rights(to_square)
+        if board.turn == chess.BLACK:
+            board.fullmove_number += 1
+        board.turn = not board.turn
+        board.halfmove_clock += 1
+        board.ep_square = None
+        self.rebase_engine_position()
+        return piece
+
+    def _drop_castling_rights(self, square, piece=None):
+        """棋子离开（或目标格被占）square后去掉失效的易位权
+
+        有走法历史时python-chess直接信任board.castling_rights，不再根据棋子位置清理，
+        因此与Board.push一样手动维护: 车离开角格去掉该角的易位权，王离开去掉该方的全部易位权
+        """
+        board = self.board
+        board.castling_rights &= ~chess.BB_SQUARES[square]
+        if piece is not None and piece.piece_type == chess.KING:
+            board.castling_rights &= ~(chess.BB_RANK_1 if piece.color == chess.WHITE else chess.BB_RANK_8)
+
+    def set_turn(self, color):
+        """只更换走棋方（变体E冻结、变体F额外回合后把回合交还玩家），不清空走法历史
+
+        已经轮到color时不做任何修改，发给引擎的走法列表保持不变
+        """
+        board = self.board
+        if board.turn == color:
+            return
+        board.turn = color
+        board.ep_square = None
+        self.rebase_engine_position()
+
+    def rebase_engine_position(self):
+        """变体效果在走法之外修改了棋盘（移除/放置棋子、更换走棋方）后调用"""
+        self.engine_root_fen = self.board.fen()
+        self.engine_moves = []
+
+    def sync_engine(self, stockfish):
+        """把当前局面以 position ... moves ... 的形式发送给引擎"""
+        stockfish.set_position(fen=self.engine_root_fen, moves=self.engine_moves)
+
+    def start_move_log(self, directory, info=None):
+        """开始记录新的一局棋，directory为空时不记录
+
+        文件头中记录随机数种子和决定变体概率的评级，配合记录中的走法可以重现整局棋（见replay_move_log.py）
+        """
+        if self.move_log is not None:
+            self.move_log.flush()
+        if not directory:
+            self.move_log = None
+            return None
+        self.move_log = MoveLog(directory, dict(
+            info or {},
+            game_id=self.game_id,
+            variant=self.chess_variant_state,
+            start_fen=self.board.fen(),
+            rng_seed=self.rng_seed,
+            user_rank=self.current_match_info.get('user_rank', ''),
+            random_move_probability=self.random_move_probability,
+        ))
+        return self.move_log.log_id
+
+    def log_move(self, move=None, flags=0, evaluation=None, square=None, piece=None):
+        """记录一步走法或一个变体效果（参数见MoveLog.append）"""
+        if self.move_log is not None:
+            if isinstance(move, str):
+                move = chess.Move.from_uci(move)
+            self.move_log.append(move, flags, evaluation, square, piece)
+
+    def log_position(self):
+        """局面被直接设置后记录当前FEN"""
+        if self.move_log is not None:
+            self.move_log.append_position(self.board.fen())
+
+    def touch(self):
+        self.last_access = time.time()
+
+
+class GameStore:
+    """以game_id为键的棋局存储，超过容量或长时间未访问的棋局会被淘汰"""
+
+    def __init__(self, max_games=1000, idle_timeout=6 * 3600):
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self._games = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_game_id():
+        return uuid.uuid4().hex
+
+    def get(self, game_id):
+        """获取棋局，不存在时返回None"""
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is not None:
+                self._games.move_to_end(game_id)
+                game.touch()
+            return game
+
+    def get_or_create(self, game_id=None):
+        """获取棋局，不存在时创建新棋局
+
+        Returns:
+            (game, created)
+        """
+        with self._lock:
+            if game_id and game_id in self._games:
+                game = self._games[game_id]
+                self._games.move_to_end(game_id)
+                game.touch()
+                return game, False
+
+            game = GameState(game_id or self.new_game_id())
+            self._games[game.game_id] = game
+            self._evict_locked()
+            return game, True
+
+    def remove(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+
+    def _evict_locked(self):
+        """淘汰长时间未访问的棋局，并保证总数不超过上限"""
+        now = time.time()
+        while self._games:
+            oldest_id, oldest = next(iter(self._games.items()))
+            if len(self._games) > self.max_games or now - oldest.last_access > self.idle_timeout:
+                self._games.popitem(last=False)
+                print(f"淘汰棋局: {oldest_id}", file=sys.stderr)
+            else:
+                break
+
+    def __len__(self):
+        with self._lock:
+            return len(self._games)
@@ -1,19 +1,63 @@
 import asyncio
 import json
-import time
+import os
+import weakref
 
 import aiohttp
 from loguru import logger
 
+from twitter_scheduler import GuestTokenPool, TokenBucket, backoff_delay
+
 limit_try_num = 3
 
 proxy_auth = None
 
 proxy_url = None
 
+# Twitter API地址，可指向本地的模拟服务器做压测
+api_base_url = os.getenv("TWITTER_API_BASE_URL", "https://api.twitter.com").rstrip("/")
+
+# 同时进行的Twitter请求数上限
+max_concurrent_requests = int(os.getenv("TWITTER_MAX_CONCURRENCY", "20"))
+
+request_timeout = aiohttp.ClientTimeout(total=15)
+
+# 每个事件循环一个长期复用的会话(连接池保持keep-alive)和并发信号量
+_sessions = weakref.WeakKeyDictionary()
+
+
+async def get_session():
+    """返回当前事件循环的共享会话和并发信号量，不存在或已关闭时创建"""
+    loop = asyncio.get_running_loop()
+    state = _sessions.get(loop)
+    if state is None or state[0].closed:
+        connector = aiohttp.TCPConnector(ssl=False, limit=100, limit_per_host=100, keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector, timeout=request_timeout)
+        state = (session, asyncio.Semaphore(max_concurrent_requests))
+        _sessions[loop] = state
+    return state
+
+
+async def close_session():
+    """关闭当前事件循环的共享会话"""
+    state = _sessions.pop(asyncio.get_running_loop(), None)
+    if state is not None and not state[0].closed:
+        await state[0].close()
+
+
+def run(coro):
+    """在新的事件循环中运行协程，结束前关闭该循环的共享会话（供同步代码调用）"""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_session()
+
+    return asyncio.run(runner())
+
 
 async def refresh_guest_token():
-    url = 'https://api.twitter.com/1.1/guest/activate.json'
+    url = f'{api_base_url}/1.1/guest/activate.json'
 
     headers = {
         'authority': 'api.twitter.com',
@@ -22,21 +66,20 @@ async def refresh_guest_token():
         'referer': 'https://twitter.com/',
     }
 
-    connector = aiohttp.TCPConnector(ssl=False, limit=100, limit_per_host=100, force_close=True)
+    session, semaphore = await get_session()
     r = None
     
-    async with aiohttp.ClientSession(connector=connector) as session:
-        try_num = 0
-        while try_num < limit_try_num:
-            try:
-                async with session.post(url, headers=headers) as response:
-                    r = await response.json()
-                    logger.info(f"Guest token refreshed successfully")
-                    return r['guest_token']
-            except Exception as e:
-                logger.error(f"Refresh guest token error: {e}")
-                try_num += 1
-                await asyncio.sleep(1)  # 添加延迟，避免请求过于频繁
+    try_num = 0
+    while try_num < limit_try_num:
+        try:
+            async with semaphore, session.post(url, headers=headers) as response:
+                r = await response.json()
+                logger.info(f"Guest token refreshed successfully")
+                return r['guest_token']
+        except Exception as e:
+            logger.error(f"Refresh guest token error: {e}")
+            await asyncio.sleep(backoff_delay(try_num))  # 指数退避加随机抖动，避免请求过于频繁
+            try_num += 1
     
     # 如果所有尝试都失败，记录错误并抛出异常
     if not r or 'guest_token' not in r:
@@ -47,12 +90,35 @@ async def refresh_guest_token():
     return r['guest_token']
 
 
-guest_token = asyncio.run(refresh_guest_token())
+# guest token池: 第一次使用时才获取token，导入模块不依赖网络；按剩余限额轮换，临近过期时在后台替换
+token_pool = GuestTokenPool(
+    refresh_guest_token,
+    size=int(os.getenv("TWITTER_GUEST_TOKEN_POOL_SIZE", "3")),
+    ttl=float(os.getenv("TWITTER_GUEST_TOKEN_TTL", str(3 * 3600))),
+    refresh_margin=float(os.getenv("TWITTER_GUEST_TOKEN_REFRESH_MARGIN", "600")),
+)
+
+# 发往Twitter的请求速率（每秒）和突发量
+request_bucket = TokenBucket(
+    rate=float(os.getenv("TWITTER_REQUESTS_PER_SECOND", "5")),
+    capacity=int(os.getenv("TWITTER_REQUEST_BURST", "10")),
+)
+
+
+async def renew_guest_token(stale_token=None):
+    """丢弃失效的token（如果给出）并立即获取一个新token，返回新token"""
+    return await token_pool.renew(stale_token)
+
+
+def scheduler_stats():
+    return {
+        'guest_tokens': token_pool.stats(),
+        'request_bucket': request_bucket.stats(),
+    }
 
 
 async def get_twitter_user_id(screen_name):
-    global guest_token
-    endpoint = "https://api.twitter.com/graphql/laYnJPCAcVo0o6pzcnlVxQ/UserByScreenName"
+    endpoint = f"{api_base_url}/graphql/laYnJPCAcVo0o6pzcnlVxQ/UserByScreenName"
     params = {
         "variables": "{\"screen_name\":\"%s\"}" % (screen_name),
         "features": "{\"hidden_profile_subscriptions_enabled\":true,\"rweb_tipjar_consumption_enabled\":true,\"responsive_web_graphql_exclude_directive_enabled\":true,\"verified_phone_label_enabled\":false,\"subscriptions_verification_info_is_identity_verified_enabled\":true,\"subscriptions_verification_info_verified_since_enabled\":true,\"highlights_tweets_tab_ui_enabled\":true,\"responsive_web_twitter_article_notes_tab_enabled\":true,\"subscriptions_feature_can_gift_premium\":true,\"creator_subscriptions_tweet_preview_api_enabled\":true,\"responsive_web_graphql_skip_user_profile_image_extensions_enabled\":false,\"responsive_web_graphql_timeline_navigation_enabled\":true}",
@@ -69,29 +135,54 @@ async def get_twitter_user_id(screen_name):
         "referer": "https://twitter.com/",
         "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
         "x-client-transaction-id": "pTJi/Qy0VYYahI4nE/udjuPrt/5hZYpqpFBjd7kH+10PJqZykh3jczzc8E/RwLFtVPl3Uac3Q3VDHq824Sh7msuwo168pg",
-        "x-guest-token": guest_token,
     }
 
-    connector = aiohttp.TCPConnector(ssl=False, limit=100, limit_per_host=100, force_close=True)
-
-    async with aiohttp.ClientSession(connector=connector) as session:
-        try_num = 0
-        while try_num < limit_try_num:
-            try_num += 1
-            try:
-                async with session.get(endpoint, headers=headers, params=params) as response:
-                    resp = await response.text()
-                    if int(response.headers.get("x-rate-limit-remaining", 0)) <= 1 or int(
-                            response.headers.get("x-rate-limit-reset", int(time.time()) - 100)) <= int(time.time()):
-                        guest_token = await refresh_guest_token()
-                        return await get_twitter_user_id(screen_name)
-                    r = json.loads(resp)
-                    return r
-            except Exception as e:
-                logger.error(f"get twitter profile info error: {e}")
-                try_num += 1
+    session, semaphore = await get_session()
+
+    try_num = 0
+    while try_num < limit_try_num:
+        if try_num:
+            await asyncio.sleep(backoff_delay(try_num - 1))
+        try_num += 1
+        try:
+            token = await token_pool.acquire()
+        except Exception as e:
+            logger.error(f"get guest token error: {e}")
+            continue
+
+        response_headers = None
+        try:
+            await request_bucket.acquire()
+            # 只在请求期间占用信号量，排队和退避时不占用
+            async with semaphore, session.get(endpoint, headers=dict(headers, **{"x-guest-token": token.value}),
+                                              params=params) as response:
+                status = response.status
+                response_headers = response.headers
+                resp = await response.text()
+        except Exception as e:
+            logger.error(f"get twitter profile info error: {e}")
+            continue
+        finally:
+            token_pool.release(token, response_headers)
+
+        if status == 429:
+            logger.warning("guest token rate limited, switching token")
+            token_pool.mark_exhausted(token)
+            continue
+        if status in (401, 403):
+            logger.warning(f"guest token rejected ({status}), discarding token")
+            token_pool.discard(token)
+            continue
+        if status >= 500:
+            logger.error(f"twitter server error: {status}")
+            continue
+
+        try:
+            return json.loads(resp)
+        except ValueError as e:
+            logger.error(f"get twitter profile info error: {e}")
 
 if __name__ == "__main__":
     username = "elonmusk"
-    user_data = asyncio.run(get_twitter_user_id(username))
+    user_data = run(get_twitter_user_id(username))
     print(json.dumps(user_data, indent=2, ensure_ascii=False))
@@ -0,0 +1,30 @@
+# gunicorn配置
+# 主进程在fork worker之前启动Stockfish引擎代理进程并预热引擎（数量由STOCKFISH_POOL_SIZE决定），
+# worker导入backend.py时通过STOCKFISH_BROKER_ADDRESS连接代理，不再各自启动Stockfish
+# 设置STOCKFISH_BROKER=0可关闭代理，恢复每个worker自带引擎池的方式
+
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+_broker_process = None
+
+
+def on_starting(server):
+    global _broker_process
+    if os.getenv("STOCKFISH_BROKER", "1") == "0":
+        return
+
+    from engine_broker import start_broker_process
+
+    address = os.environ.setdefault("STOCKFISH_BROKER_ADDRESS", f"/tmp/vibechess-engine-{os.getpid()}.sock")
+    authkey = os.environ.setdefault("STOCKFISH_BROKER_AUTHKEY", os.urandom(16).hex())
+    _broker_process = start_broker_process(address, authkey.encode())
+    server.log.info("Stockfish引擎代理进程已启动: pid=%s address=%s", _broker_process.pid, address)
+
+
+def on_exit(server):
+    if _broker_process is not None and _broker_process.is_alive():
+        _broker_process.terminate()
+        _broker_process.join(5)
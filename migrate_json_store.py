@@ -0,0 +1,83 @@
+"""
+把旧的 twitter_data_*.json 和 match_data_*.json 文件导入SQLite数据库
+可以重复运行：资料按用户名覆盖，比赛记录按 (用户, 开始时间) 去重
+
+用法:
+    python migrate_json_store.py --source . --db vibechess.db [--delete]
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from data_store import DataStore
+
+PROFILE_PREFIX = "twitter_data_"
+MATCH_PREFIX = "match_data_"
+
+
+def load_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取 {path} 失败: {e}", file=sys.stderr)
+        return None
+
+
+def collect(source):
+    """读取目录中的旧文件
+
+    Returns:
+        (profiles, matches, imported_paths)
+    """
+    profiles, matches, paths = [], [], []
+
+    for path in sorted(glob.glob(os.path.join(source, f"{PROFILE_PREFIX}*.json"))):
+        data = load_json(path)
+        if data is None:
+            continue
+        username = os.path.basename(path)[len(PROFILE_PREFIX):-len(".json")]
+        profiles.append((username, data))
+        paths.append(path)
+
+    for path in sorted(glob.glob(os.path.join(source, f"{MATCH_PREFIX}*.json"))):
+        data = load_json(path)
+        if data is None or not data.get('twitter_user') or 'match_start_time' not in data:
+            print(f"跳过不完整的比赛记录: {path}", file=sys.stderr)
+            continue
+        matches.append(data)
+        paths.append(path)
+
+    return profiles, matches, paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把旧的JSON资料和比赛记录文件导入SQLite数据库")
+    parser.add_argument("--source", default=".", help="旧文件所在目录")
+    parser.add_argument("--db", default=os.getenv("DATA_STORE_PATH", "vibechess.db"), help="数据库路径")
+    parser.add_argument("--batch-size", type=int, default=500, help="每个事务写入的记录数")
+    parser.add_argument("--delete", action="store_true", help="导入成功后删除旧文件")
+    args = parser.parse_args()
+
+    profiles, matches, paths = collect(args.source)
+    store = DataStore(args.db)
+
+    for i in range(0, len(profiles), args.batch_size):
+        store.write_batch(profiles=profiles[i:i + args.batch_size])
+    inserted = 0
+    for i in range(0, len(matches), args.batch_size):
+        inserted += store.write_batch(matches=matches[i:i + args.batch_size])
+
+    print(f"已导入 {len(profiles)} 个用户资料，{inserted} 场新比赛（共读取 {len(matches)} 场）", file=sys.stderr)
+
+    if args.delete:
+        for path in paths:
+            os.remove(path)
+        print(f"已删除 {len(paths)} 个旧文件", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
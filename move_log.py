@@ -0,0 +1,233 @@
+"""
+对局走法记录
+每局棋一个只追加的二进制文件: 文件头（魔数、版本、JSON格式的对局信息）之后是定长8字节的走法记录，
+每条记录包含16位编码的走法、变体效果标志、附加格子和走完后的评估。
+每步只在文件末尾追加，读取一局棋只需打开它自己的文件
+"""
+
+import json
+import os
+import re
+import struct
+import sys
+import time
+import uuid
+
+import chess
+
+MAGIC = b"VCML"
+VERSION = 1
+# 魔数 + 版本 + 对局信息JSON的长度
+HEADER = struct.Struct("<4sBH")
+# 走法(u16) + 标志(u16) + 附加信息(u16) + 评估(i16)
+RECORD = struct.Struct("<HHHh")
+
+# 标志位
+FLAG_AI = 0x0001            # AI的走法，否则为玩家的走法
+FLAG_RANDOM = 0x0002        # 随机走位改变了玩家选择的目标格，附加信息为原目标格（原走法升变时附带升变棋子）
+FLAG_VARIANT_MOVE = 0x0004  # 变体A/B的特殊走法（不经过标准规则，直接移动棋子）
+FLAG_FROZEN_MOVE = 0x0008   # 变体E: AI避开被冻结的棋子走棋
+FLAG_VANISH = 0x0010        # 变体D: AI吃子后自爆，附加信息为被移除棋子的格子
+FLAG_FREEZE = 0x0020        # 变体E: AI吃子后被冻结，附加信息为冻结的格子
+FLAG_BONUS = 0x0040         # 变体F: 效果记录（走法为0），附加信息为获得额外回合的棋子格子，回合交还该棋子一方
+FLAG_TRANSFORM = 0x0080     # 变体G: 效果记录（走法为0），附加信息为新棋子的格子和棋子
+FLAG_POSITION = 0x0100      # 局面被直接设置，记录后紧跟走法字段长度的FEN字节
+
+FLAG_NAMES = {
+    FLAG_AI: 'ai',
+    FLAG_RANDOM: 'random_move',
+    FLAG_VARIANT_MOVE: 'variant_move',
+    FLAG_FROZEN_MOVE: 'frozen_move',
+    FLAG_VANISH: 'vanish',
+    FLAG_FREEZE: 'freeze',
+    FLAG_BONUS: 'bonus_move',
+    FLAG_TRANSFORM: 'transform',
+    FLAG_POSITION: 'position',
+}
+
+# 不包含走法、只修改棋盘的效果记录
+EFFECT_FLAGS = FLAG_BONUS | FLAG_TRANSFORM
+
+NO_SQUARE = 0xFF
+# 评估编码: 分数限制在 ±EVAL_MATE_BASE 以内，将杀记为 ±(EVAL_MATE_BASE + 步数)，未知为EVAL_UNKNOWN
+EVAL_MATE_BASE = 30000
+EVAL_UNKNOWN = -32768
+
+LOG_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def encode_move(move):
+    """from(6位) | to(6位) | 升变棋子类型(3位，0表示不升变)"""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(value):
+    return chess.Move(value & 0x3F, (value >> 6) & 0x3F, promotion=(value >> 12) & 0x7 or None)
+
+
+def encode_aux(square=None, piece=None):
+    """低8位为格子，高8位为棋子类型（白棋再加0x80）"""
+    aux = NO_SQUARE if square is None else square
+    if piece is not None:
+        aux |= (piece.piece_type | (0x80 if piece.color == chess.WHITE else 0)) << 8
+    return aux
+
+
+def decode_aux(aux):
+    square = aux & 0xFF
+    piece_bits = aux >> 8
+    piece = chess.Piece(piece_bits & 0x7, bool(piece_bits & 0x80)) if piece_bits else None
+    return (None if square == NO_SQUARE else square), piece
+
+
+def encode_eval(evaluation):
+    """{'type': 'cp'|'mate', 'value': n} -> i16"""
+    if not evaluation:
+        return EVAL_UNKNOWN
+    value = int(evaluation.get('value', 0))
+    if evaluation.get('type') == 'mate':
+        steps = min(abs(value), 32767 - EVAL_MATE_BASE)
+        return EVAL_MATE_BASE + steps if value >= 0 else -(EVAL_MATE_BASE + steps)
+    return max(-EVAL_MATE_BASE + 1, min(EVAL_MATE_BASE - 1, value))
+
+
+def decode_eval(value):
+    if value == EVAL_UNKNOWN:
+        return None
+    if abs(value) >= EVAL_MATE_BASE:
+        steps = abs(value) - EVAL_MATE_BASE
+        return {'type': 'mate', 'value': steps if value > 0 else -steps}
+    return {'type': 'cp', 'value': value}
+
+
+class MoveLog:
+    """一局棋的记录，走法先放在内存缓冲区中，每个请求结束时调用flush一次追加到文件"""
+
+    def __init__(self, directory, info):
+        """
+        Args:
+            directory: 记录文件所在目录
+            info: 对局信息（game_id、变体、执子方、Twitter用户等），写入文件头
+        """
+        self.log_id = uuid.uuid4().hex
+        self.path = os.path.join(directory, f"{self.log_id}.mlog")
+        self.records = 0
+        info = dict(info, log_id=self.log_id, started_at=time.time())
+        payload = json.dumps(info, ensure_ascii=False).encode("utf-8")
+        self._buffer = bytearray(HEADER.pack(MAGIC, VERSION, len(payload)) + payload)
+
+    def append(self, move=None, flags=0, evaluation=None, square=None, piece=None):
+        """记录一步走法或一个变体效果"""
+        self._buffer += RECORD.pack(
+            encode_move(move) if move is not None else 0,
+            flags,
+            encode_aux(square, piece),
+            encode_eval(evaluation)
+        )
+        self.records += 1
+
+    def append_position(self, fen):
+        """局面被直接设置（例如前端发来FEN），之后的走法以该局面为起点"""
+        data = fen.encode("ascii")
+        self._buffer += RECORD.pack(len(data), FLAG_POSITION, encode_aux(), EVAL_UNKNOWN) + data
+        self.records += 1
+
+    def flush(self):
+        """把缓冲区追加到文件末尾，失败时保留缓冲区下次再写"""
+        if not self._buffer:
+            return
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, self._buffer)
+            finally:
+                os.close(fd)
+            self._buffer.clear()
+        except OSError as e:
+            print(f"写入对局记录失败 ({self.log_id}): {e}", file=sys.stderr)
+
+
+def log_path(directory, log_id):
+    """log_id不合法时返回None，避免拼出目录外的路径"""
+    if not LOG_ID_PATTERN.match(log_id or ''):
+        return None
+    return os.path.join(directory, f"{log_id}.mlog")
+
+
+def read_log(path):
+    """读取一局棋的记录
+
+    Returns:
+        (对局信息字典, 记录列表)，每条记录为
+        {'move': uci或None, 'flags': [...], 'square': 格子名或None, 'piece': 棋子符号或None,
+         'evaluation': 评估或None, 'fen': 仅position记录}
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, info_len = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"不是对局记录文件: {path}")
+    offset = HEADER.size
+    info = json.loads(data[offset:offset + info_len].decode("utf-8"))
+    offset += info_len
+
+    records = []
+    # 最后一条记录可能在写入时被截断，忽略不完整的尾部
+    while offset + RECORD.size <= len(data):
+        move_value, flags, aux, eval_value = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        square, piece = decode_aux(aux)
+        record = {
+            'move': None,
+            'flags': [name for bit, name in FLAG_NAMES.items() if flags & bit],
+            'square': chess.square_name(square) if square is not None else None,
+            'piece': piece.symbol() if piece else None,
+            'evaluation': decode_eval(eval_value),
+        }
+        if flags & FLAG_POSITION:
+            if offset + move_value > len(data):
+                break
+            record['fen'] = data[offset:offset + move_value].decode("ascii")
+            offset += move_value
+        elif not flags & EFFECT_FLAGS:
+            record['move'] = decode_move(move_value).uci()
+        records.append(record)
+    return info, records
+
+
+def replay(info, records):
+    """按记录重放一局棋，返回最终局面
+
+    变体走法和变体效果按与backend.py相同的方式修改棋盘
+    """
+    board = chess.Board(info.get('start_fen') or chess.STARTING_FEN)
+    for record in records:
+        flags = set(record['flags'])
+        if 'position' in flags:
+            board.set_fen(record['fen'])
+            continue
+        if 'transform' in flags:
+            board.set_piece_at(chess.parse_square(record['square']), chess.Piece.from_symbol(record['piece']))
+            continue
+        if 'bonus_move' in flags:
+            # 额外回合: 轮到获得额外回合的棋子一方继续走
+            board.turn = board.piece_at(chess.parse_square(record['square'])).color
+            continue
+
+        move = chess.Move.from_uci(record['move'])
+        if 'variant_move' in flags:
+            # 与backend.py中的特殊变体走法一致: 直接移动棋子，只更新回合和计数
+            piece = board.remove_piece_at(move.from_square)
+            board.set_piece_at(move.to_square, piece)
+            if board.turn == chess.BLACK:
+                board.fullmove_number += 1
+            board.turn = not board.turn
+            board.halfmove_clock += 1
+            board.ep_square = None
+        else:
+            board.push(move)
+
+        if 'vanish' in flags:
+            board.remove_piece_at(chess.parse_square(record['square']))
+    return board
@@ -0,0 +1,119 @@
+"""
+Polyglot格式的开局库
+开局阶段先查询开局库（内存映射文件，按Zobrist哈希二分查找），查不到时才交给Stockfish搜索
+开局库由 build_opening_book.py 离线生成
+"""
+
+import random
+import struct
+import sys
+
+import chess
+import chess.polyglot
+
+# Polyglot条目: key(8字节) move(2字节) weight(2字节) learn(4字节)，大端
+ENTRY_STRUCT = struct.Struct(">QHHI")
+
+# learn字段保存白方视角的厘兵评估，加上偏移量后存为无符号数
+LEARN_OFFSET = 0x8000
+LEARN_MAX_CP = 0x7FFF
+
+PROMOTION_CODES = {chess.KNIGHT: 1, chess.BISHOP: 2, chess.ROOK: 3, chess.QUEEN: 4}
+
+
+def encode_move(board, move):
+    """按Polyglot规则编码走法，王车易位编码为王走到车的位置"""
+    to_square = move.to_square
+    if board.is_castling(move):
+        rank = chess.square_rank(move.from_square)
+        rook_file = 7 if chess.square_file(move.to_square) > chess.square_file(move.from_square) else 0
+        to_square = chess.square(rook_file, rank)
+
+    code = chess.square_file(to_square) | (chess.square_rank(to_square) << 3)
+    code |= (chess.square_file(move.from_square) << 6) | (chess.square_rank(move.from_square) << 9)
+    if move.promotion:
+        code |= PROMOTION_CODES[move.promotion] << 12
+    return code
+
+
+def encode_learn(evaluation):
+    """把 {'type': 'cp'|'mate', 'value': n} 编码进learn字段"""
+    if evaluation['type'] == 'mate':
+        cp = LEARN_MAX_CP if evaluation['value'] > 0 else -LEARN_MAX_CP
+    else:
+        cp = max(-LEARN_MAX_CP, min(LEARN_MAX_CP, evaluation['value']))
+    return cp + LEARN_OFFSET
+
+
+def decode_learn(learn):
+    cp = learn - LEARN_OFFSET
+    if abs(cp) >= LEARN_MAX_CP:
+        return {'type': 'mate', 'value': 1 if cp > 0 else -1}
+    return {'type': 'cp', 'value': cp}
+
+
+def write_book(path, entries):
+    """写入Polyglot开局库
+
+    Args:
+        entries: (key, move_code, weight, learn) 列表，写入前按key排序
+    """
+    with open(path, "wb") as f:
+        for key, move_code, weight, learn in sorted(entries):
+            f.write(ENTRY_STRUCT.pack(key, move_code, weight, learn))
+
+
+class OpeningBook:
+    """只读的开局库，可在多个引擎和线程之间共享"""
+
+    def __init__(self, path):
+        self.path = path
+        self._reader = chess.polyglot.open_reader(path)
+        self.hits = 0
+        self.misses = 0
+        print(f"已加载开局库: {path} ({len(self._reader)} 条)", file=sys.stderr)
+
+    def choose(self, board, skill_level=20):
+        """为当前局面从开局库中选一步棋
+
+        技能等级越低，权重分布越平坦，弱设置下也会选到次优的库内走法；技能等级20时只选权重最高的走法
+
+        Returns:
+            与StockfishWrapper.search格式相同的结果，局面不在库中时返回None
+        """
+        entries = list(self._reader.find_all(board))
+        if not entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        if skill_level is None or skill_level >= 20:
+            entry = max(entries, key=lambda e: e.weight)
+        else:
+            # 技能等级0时按权重的平方根抽样，等级越高越偏向高权重走法
+            exponent = 0.5 + skill_level / 4
+            weights = [max(e.weight, 1) ** exponent for e in entries]
+            entry = random.choices(entries, weights=weights)[0]
+
+        move = entry.move.uci()
+        return {
+            'bestmove': move,
+            'evaluation': decode_learn(entry.learn),
+            'pv': [move],
+            'depth': 0,
+            'lines': [],
+            'book': True,
+        }
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'path': self.path,
+            'entries': len(self._reader),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self._reader.close()
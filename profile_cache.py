@@ -0,0 +1,207 @@
+"""
+Twitter资料缓存
+/twitter_info 和 /api/twitter_profile 先查缓存再请求Twitter：内存LRU + 磁盘目录两级，
+按字段类别设置不同的有效期；过期不久的资料直接返回，同时在后台刷新（stale-while-revalidate）；
+同一用户的并发请求合并为一次Twitter请求
+"""
+
+import asyncio
+import copy
+import json
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+# 字段类别及其有效期（秒）: 计数类字段（决定用户评级）变化快，基本资料变化慢
+FIELD_CLASS_TTLS = {
+    'counts': 15 * 60,
+    'profile': 24 * 3600,
+}
+
+# 只缓存合法的Twitter用户名，磁盘文件名直接使用用户名
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+
+
+class ProfileCache:
+    """Twitter资料的两级缓存
+
+    所有方法都在后台事件循环线程中调用（见backend.py的async_loop），因此不需要加锁
+    """
+
+    def __init__(self, max_entries=5000, directory=None, field_class_ttls=None, max_stale=7 * 24 * 3600):
+        """
+        Args:
+            max_entries: 内存中最多保留的用户数
+            directory: 磁盘缓存目录，None时只保存在内存中
+            field_class_ttls: 各字段类别的有效期，默认FIELD_CLASS_TTLS
+            max_stale: 超过有效期后仍可先返回、再后台刷新的最长时间（秒），超过后必须重新请求
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.field_class_ttls = dict(field_class_ttls or FIELD_CLASS_TTLS)
+        self.max_stale = max_stale
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.coalesced = 0
+
+        self._entries = OrderedDict()
+        # 进行中的请求: 用户名 -> asyncio.Task
+        self._inflight = {}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def normalize(username):
+        """Twitter用户名不区分大小写"""
+        username = username.strip().lstrip('@').lower()
+        return username if USERNAME_PATTERN.match(username) else None
+
+    @staticmethod
+    def is_cacheable(user_data):
+        """只缓存包含用户资料的响应，错误和用户不存在的响应不缓存"""
+        try:
+            return 'legacy' in user_data['data']['user']['result']
+        except (KeyError, TypeError):
+            return False
+
+    async def get(self, username, fetch, field_classes=('counts', 'profile')):
+        """返回用户资料，按需调用fetch(username)请求Twitter
+
+        同一用户的并发请求共享同一次进行中的fetch
+
+        Args:
+            username: Twitter用户名
+            fetch: 请求Twitter的协程函数，例如 get_id.get_twitter_user_id
+            field_classes: 调用方需要的字段类别，有效期取其中最短的。每次请求Twitter都会取回全部字段，
+                缓存按整条资料记录请求时间，只需要基本资料的调用方传 ('profile',) 即可使用更长的有效期
+        """
+        key = self.normalize(username)
+        if key is not None:
+            ttl = min(self.field_class_ttls[name] for name in field_classes)
+            entry = self._lookup(key)
+            if entry is not None:
+                age = time.time() - entry['fetched_at']
+                if age < ttl:
+                    self.hits += 1
+                    return copy.deepcopy(entry['data'])
+                if age < ttl + self.max_stale:
+                    # 先返回旧资料，同一用户同时只有一个后台刷新
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        self.refreshes += 1
+                        self._start_fetch(key, username, fetch)
+                    return copy.deepcopy(entry['data'])
+
+        self.misses += 1
+        # 不可缓存的用户名同样合并并发请求，只是结果不写入缓存
+        flight_key = key if key is not None else username
+        task = self._inflight.get(flight_key)
+        if task is None:
+            task = self._start_fetch(flight_key, username, fetch, cache=key is not None)
+        else:
+            self.coalesced += 1
+        # shield: 某个调用方超时被取消时，不影响其他等待同一次请求的调用方
+        return copy.deepcopy(await asyncio.shield(task))
+
+    def _start_fetch(self, flight_key, username, fetch, cache=True):
+        task = asyncio.get_running_loop().create_task(self._fetch(flight_key, username, fetch, cache))
+        # 后台刷新没有调用方等待结果，这里读取异常以免事件循环报告未处理的异常
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[flight_key] = task
+        return task
+
+    async def _fetch(self, flight_key, username, fetch, cache):
+        self.fetches += 1
+        try:
+            user_data = await fetch(username)
+            if not self.is_cacheable(user_data):
+                self.fetch_failures += 1
+            elif cache:
+                self.put(flight_key, user_data)
+            return user_data
+        except Exception as e:
+            self.fetch_failures += 1
+            print(f"请求Twitter资料失败 ({username}): {e}", file=sys.stderr)
+            raise
+        finally:
+            self._inflight.pop(flight_key, None)
+
+    def _lookup(self, key):
+        """先查内存，再查磁盘（命中后放回内存）"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+
+        entry = self._load(key)
+        if entry is not None:
+            self.disk_hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, user_data):
+        entry = {'fetched_at': time.time(), 'data': copy.deepcopy(user_data)}
+        self._remember(key, entry)
+        self._save(key, entry)
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"读取Twitter资料缓存失败 ({key}): {e}", file=sys.stderr)
+            return None
+
+    def _save(self, key, entry):
+        """先写临时文件再替换，避免写坏"""
+        if not self.directory:
+            return
+        try:
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"保存Twitter资料缓存失败 ({key}): {e}", file=sys.stderr)
+
+    def stats(self):
+        total = self.hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'directory': self.directory,
+            'ttls': self.field_class_ttls,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'fetches': self.fetches,
+            'fetch_failures': self.fetch_failures,
+            'coalesced': self.coalesced,
+            'inflight': len(self._inflight),
+            'hit_rate': (self.hits + self.stale_hits) / total if total else 0.0,
+        }
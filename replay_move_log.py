@@ -0,0 +1,189 @@
+"""
+按随机数种子重放对局记录
+用文件头中的种子、变体、评级和随机走位概率重新开一局棋，把玩家原本选择的走法依次交给VariantEngine，
+AI按记录中的走法应答（不需要Stockfish），再逐条对比重放得到的记录和原记录。
+变体规则层的行为变化会在第一处分歧报告出来；同时输出每步规则层的耗时，可用于性能回归测试。
+
+用法:
+    python replay_move_log.py move_logs/<log_id>.mlog
+    python replay_move_log.py move_logs --repeat 10
+"""
+
+import argparse
+import contextlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import chess
+
+import move_log
+from game_session import GameState
+from variant_rules import VariantEngine
+
+
+class ScriptedEngine:
+    """模拟引擎: 本回合的AI走法和评估取自原记录"""
+
+    def __init__(self, bestmove=None, evaluation=None):
+        self.result = {'bestmove': bestmove, 'evaluation': evaluation, 'pv': [], 'depth': 0}
+
+    def set_position(self, fen=None, moves=None):
+        pass
+
+    def search(self):
+        return self.result
+
+    def search_excluding(self, excluded_from_squares):
+        return self.result
+
+    def get_evaluation(self):
+        return self.result['evaluation']
+
+
+def requested_move(record):
+    """玩家原本选择的走法: 随机走位时目标格（和升变棋子）记录在附加信息中"""
+    move = chess.Move.from_uci(record['move'])
+    if 'random_move' in record['flags']:
+        promotion = chess.Piece.from_symbol(record['piece']).piece_type if record['piece'] else None
+        move = chess.Move(move.from_square, chess.parse_square(record['square']), promotion=promotion)
+    return move
+
+
+def split_turns(records):
+    """按回合分组: 玩家走法 + 可能的AI应答 + 之后的效果记录；局面记录和单独的AI走法各自成组"""
+    turns = []
+    for record in records:
+        flags = record['flags']
+        turn = turns[-1] if turns else None
+        in_player_turn = turn is not None and not {'ai', 'position'} & set(turn[0]['flags'])
+        if in_player_turn and ('bonus_move' in flags or 'transform' in flags):
+            turn.append(record)
+        elif in_player_turn and 'ai' in flags and len(turn) == 1:
+            # AI应答紧跟在玩家走法之后，效果记录在AI走法之后
+            turn.append(record)
+        else:
+            turns.append([record])
+    return turns
+
+
+def new_game(info):
+    game = GameState(info.get('game_id') or 'replay')
+    game.chess_variant_state = info.get('variant', 'normal')
+    game.random_move_probability = info.get('random_move_probability', game.random_move_probability)
+    game.current_match_info['user_rank'] = info.get('user_rank', '')
+    game.set_fen(info.get('start_fen') or chess.STARTING_FEN)
+    game.seed_rng(info['rng_seed'])
+    return game
+
+
+def replay_log(path, engine=None, log_dir=None):
+    """重放一局棋
+
+    Returns:
+        (重放得到的记录, 每回合规则层耗时列表（微秒）)
+    """
+    engine = engine or VariantEngine()
+    info, records = move_log.read_log(path)
+    if info.get('rng_seed') is None:
+        raise ValueError("记录中没有随机数种子，无法重放")
+
+    game = new_game(info)
+    game.start_move_log(log_dir)
+    samples = []
+    # 规则层的日志写到stderr，重放时不输出；重放本身的诊断信息输出到stdout
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(devnull):
+            for turn in split_turns(records):
+                first = turn[0]
+                flags = first['flags']
+                if 'position' in flags:
+                    game.set_fen(first['fen'])
+                    game.log_position()
+                    continue
+                if 'ai' in flags:
+                    # 没有对应玩家走法的AI走法（玩家执黑时的第一步、直接设置局面之后）
+                    game.push_move(first['move'])
+                    game.log_move(first['move'], move_log.FLAG_AI, first['evaluation'])
+                    continue
+
+                ai = next((r for r in turn[1:] if 'ai' in r['flags']), None)
+                stockfish = ScriptedEngine(ai['move'] if ai else None, (ai or first)['evaluation'])
+                move = requested_move(first)
+                start = time.perf_counter()
+                if 'variant_move' in flags:
+                    engine.play_special_move(game, move.from_square, move.to_square, stockfish)
+                else:
+                    engine.response(engine.play_turn(game, move, stockfish))
+                samples.append((time.perf_counter() - start) * 1e6)
+    except (AssertionError, ValueError) as e:
+        # 之前的随机判定已经不同，原记录中的走法在重放的局面中不再合法；之后的记录不再对比
+        print(f"{path}: 第 {len(samples)} 回合之后无法继续重放: {e}")
+
+    if game.move_log is None:
+        return None, samples
+    game.move_log.flush()
+    return move_log.read_log(game.move_log.path)[1], samples
+
+
+def first_difference(expected, actual):
+    for index, (a, b) in enumerate(zip(expected, actual)):
+        if a != b:
+            return index, a, b
+    if len(expected) != len(actual):
+        index = min(len(expected), len(actual))
+        return index, expected[index:index + 1], actual[index:index + 1]
+    return None
+
+
+def log_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.mlog'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按随机数种子重放对局记录并对比变体效果")
+    parser.add_argument("paths", nargs="+", help="记录文件或记录目录")
+    parser.add_argument("--repeat", type=int, default=1, help="计时时每局重放的次数")
+    args = parser.parse_args()
+
+    engine = VariantEngine()
+    samples = []
+    failed = 0
+    with tempfile.TemporaryDirectory() as log_dir:
+        for path in log_files(args.paths):
+            try:
+                _, expected = move_log.read_log(path)
+                actual, turn_samples = replay_log(path, engine, log_dir)
+                for _ in range(args.repeat - 1):
+                    turn_samples += replay_log(path, engine)[1]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"{path}: 跳过 ({e})")
+                continue
+
+            samples += turn_samples
+            diff = first_difference(expected, actual)
+            if diff is None:
+                print(f"{path}: 一致 ({len(expected)} 条记录)")
+            else:
+                failed += 1
+                index, a, b = diff
+                print(f"{path}: 第 {index} 条记录不一致\n    原记录: {a}\n    重放:   {b}")
+
+    if samples:
+        samples.sort()
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        print(f"{len(samples)} 个回合, 规则层耗时 p50 {statistics.median(samples):.1f} 微秒, "
+              f"p99 {p99:.1f} 微秒, 平均 {statistics.mean(samples):.1f} 微秒")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
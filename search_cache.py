@@ -0,0 +1,120 @@
+"""
+Stockfish搜索结果缓存
+以规范化FEN + 技能等级 + 搜索限制为键，LRU淘汰，可选地保存到磁盘文件以便重启后继续使用；
+可能受重复局面或50回合规则影响的局面不使用缓存
+"""
+
+import atexit
+import copy
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+class SearchCache:
+    """线程安全的LRU搜索结果缓存，可在多个引擎之间共享"""
+
+    # 半回合计数达到该值后，50回合规则（半回合计数100）可能出现在引擎的搜索范围内
+    HALFMOVE_CLOCK_LIMIT = 70
+
+    def __init__(self, max_entries=10000, path=None):
+        """
+        Args:
+            max_entries: 最多保留的局面数量
+            path: 磁盘备份文件路径，None时只保存在内存中
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def make_key(board, skill_level, limit, searchmoves=None):
+        """生成缓存键
+
+        Args:
+            board: chess.Board
+            skill_level: 技能等级
+            limit: 搜索限制，例如 'depth 15' 或 'movetime 200'
+            searchmoves: 限定搜索的走法列表
+        """
+        # 只保留棋子、走棋方、易位权和真正可吃的过路兵，忽略半回合和回合计数（见is_cacheable）
+        fen = board.fen(en_passant='legal').rsplit(' ', 2)[0]
+        moves = ','.join(sorted(searchmoves)) if searchmoves else '*'
+        return f"{fen}|{skill_level}|{limit}|{moves}"
+
+    @classmethod
+    def is_cacheable(cls, board):
+        """局面的搜索结果是否只取决于缓存键
+
+        引擎收到的是 position ... moves ...，能识别重复局面和50回合规则，而缓存键不包含走法历史；
+        当前局面已经出现过或半回合计数接近100时，相同FEN的搜索结果可能不同，不读也不写缓存
+
+        Args:
+            board: 带有自上一步不可逆走法以来走法历史的chess.Board
+        """
+        return board.halfmove_clock < cls.HALFMOVE_CLOCK_LIMIT and not board.is_repetition(2)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(value)
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = copy.deepcopy(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        """从磁盘文件加载缓存"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            with self._lock:
+                for key, value in entries[-self.max_entries:]:
+                    self._entries[key] = value
+            print(f"从 {self.path} 加载了 {len(self._entries)} 条搜索缓存", file=sys.stderr)
+        except Exception as e:
+            print(f"加载搜索缓存失败: {e}", file=sys.stderr)
+
+    def save(self):
+        """把缓存写入磁盘文件（先写临时文件再替换，避免写坏）"""
+        if not self.path:
+            return
+        try:
+            with self._lock:
+                entries = list(self._entries.items())
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"保存搜索缓存失败: {e}", file=sys.stderr)
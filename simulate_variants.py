@@ -0,0 +1,343 @@
+"""
+变体/评级概率的离线模拟
+不经过Web服务，直接用VariantEngine（与 /move 相同的规则代码）批量对局，统计各变体、各评级下玩家的胜率，
+用于调整variant_rules.py中的评级概率表。玩家和AI都由可替换的简单策略走棋，AI也可以换成低深度的Stockfish
+（每个工作进程一个引擎）；对局分批在进程池中并行执行。
+每局的随机数种子由 --seed 和对局序号决定，不同变体和评级使用相同的种子序列，两次运行的结果完全相同。
+
+用法:
+    python simulate_variants.py --games 2000 --variants D,E,F,G --ranks A,D,G
+    python simulate_variants.py --games 200 --opponent stockfish --depth 2 --override F:G=0.5
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import chess
+
+from game_session import GameState
+from stockfish_wrapper import StockfishWrapper
+from variant_rules import RANDOM_MOVE_PROBABILITIES, RULES, VariantEngine
+
+PIECE_VALUES = {chess.PAWN: 100, chess.KNIGHT: 300, chess.BISHOP: 320, chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0}
+
+# 模拟结果: 玩家胜、AI胜、和棋、达到回合上限仍未分出胜负
+RESULTS = ('win', 'loss', 'draw', 'unfinished')
+
+
+def random_policy(board, moves, rng):
+    return rng.choice(moves)
+
+
+def greedy_policy(board, moves, rng):
+    """一步贪心: 吃子得分为被吃棋子的价值，走到对方攻击的格子扣除己方棋子的价值（不考虑保护），
+    得分相同的走法中随机选择，不会主动走出亏子的交换
+    """
+    them = not board.turn
+    attacked = 0
+    for square in chess.scan_reversed(board.occupied_co[them]):
+        attacked |= board.attacks_mask(square)
+    best_score = None
+    best = []
+    for move in moves:
+        score = PIECE_VALUES[move.promotion] - PIECE_VALUES[chess.PAWN] if move.promotion else 0
+        if board.color_at(move.to_square) == them:
+            score += PIECE_VALUES[board.piece_type_at(move.to_square)]
+        if attacked & chess.BB_SQUARES[move.to_square]:
+            score -= PIECE_VALUES[move.promotion or board.piece_type_at(move.from_square)]
+        if best_score is None or score > best_score:
+            best_score, best = score, [move]
+        elif score == best_score:
+            best.append(move)
+    return rng.choice(best)
+
+
+POLICIES = {'random': random_policy, 'greedy': greedy_policy}
+
+
+def material(board):
+    """白方视角的子力差（厘兵）"""
+    score = 0
+    for piece_type, value in PIECE_VALUES.items():
+        score += value * (chess.popcount(board.pieces_mask(piece_type, chess.WHITE)) -
+                          chess.popcount(board.pieces_mask(piece_type, chess.BLACK)))
+    return score
+
+
+class PolicyEngine:
+    """按策略走棋的模拟引擎，接口与StockfishWrapper一致（set_position/search/search_excluding/get_evaluation）
+
+    直接读取对局的棋盘: sync_engine总是在搜索前发送当前局面，因此不需要再按FEN和走法列表重建一个棋盘
+    """
+
+    def __init__(self, policy, rng, board=None):
+        self.policy = policy
+        self.rng = rng
+        self.board = board
+
+    def set_position(self, fen=None, moves=None):
+        pass
+
+    def _result(self, moves):
+        return {
+            'bestmove': self.policy(self.board, moves, self.rng).uci() if moves else None,
+            'evaluation': self.get_evaluation(),
+            'pv': [],
+            'depth': 1,
+        }
+
+    def search(self):
+        return self._result(list(self.board.legal_moves))
+
+    def search_excluding(self, excluded_from_squares):
+        from_mask = chess.BB_ALL
+        for name in excluded_from_squares:
+            from_mask &= ~chess.BB_SQUARES[chess.parse_square(name)]
+        return self._result(list(self.board.generate_legal_moves(from_mask=from_mask)))
+
+    def get_evaluation(self):
+        return {'type': 'cp', 'value': material(self.board)}
+
+
+def game_result(board, player_color, moves, adjudicate=0):
+    """对局结束时返回RESULTS中的结果，尚未结束时返回None
+
+    moves为走棋方的全部合法走法（调用方已经生成，这里不再重复生成）。
+    变体D可能让吃子的国王自爆，国王不在棋盘上的一方判负；
+    达到75回合规则时，adjudicate不为0且子力差不小于adjudicate的一方判胜
+    """
+    for color in chess.COLORS:
+        if not board.pieces_mask(chess.KING, color):
+            return 'loss' if color == player_color else 'win'
+    if not moves:
+        if not board.is_check():
+            return 'draw'
+        return 'loss' if board.turn == player_color else 'win'
+    if board.is_insufficient_material():
+        return 'draw'
+    if board.halfmove_clock >= 150:
+        return adjudicated(board, player_color, adjudicate) or 'draw'
+    return None
+
+
+def adjudicated(board, player_color, adjudicate):
+    """按子力差判定胜负，差距不足时返回None"""
+    if not adjudicate:
+        return None
+    score = material(board) if player_color == chess.WHITE else -material(board)
+    if score >= adjudicate:
+        return 'win'
+    if score <= -adjudicate:
+        return 'loss'
+    return None
+
+
+def play_game(engine, variant, rank, seed, player_policy, opponent_policy, max_turns, random_move_probabilities,
+              adjudicate=0, stockfish=None):
+    """模拟一局棋，玩家在偶数种子执白、奇数种子执黑
+
+    Args:
+        opponent_policy: AI的走棋策略
+        adjudicate: 判定胜负所需的子力差（厘兵），用于达到回合上限或75回合规则的对局，0表示不判定
+        stockfish: 指定时由该引擎代替opponent_policy为AI走棋
+
+    Returns:
+        (结果, 玩家的回合数, 触发的效果列表)
+    """
+    game = GameState(f"sim-{variant}-{rank}-{seed}")
+    game.seed_rng(seed)
+    game.chess_variant_state = variant
+    game.random_move_probability = random_move_probabilities.get(rank, 0.0)
+    game.current_match_info['user_rank'] = rank
+    player_color = chess.WHITE if seed % 2 == 0 else chess.BLACK
+    player_rng = random.Random(f"{seed}:player")
+    board = game.board
+    opponent = stockfish or PolicyEngine(opponent_policy, random.Random(f"{seed}:opponent"), board)
+    effects = []
+
+    if player_color == chess.BLACK:
+        # 与 /set_side 一致: 玩家执黑时AI先走一步
+        game.sync_engine(opponent)
+        game.push_move(opponent.search()['bestmove'])
+
+    turns = 0
+    while turns < max_turns:
+        if board.turn != player_color:
+            # AI没有走棋: 玩家将死或逼和了AI，否则是AI走法无法执行
+            result = game_result(board, player_color, list(board.legal_moves), adjudicate)
+            return result or 'unfinished', turns, effects
+        moves, special_moves = engine.legal_moves(game)
+        result = game_result(board, player_color, moves, adjudicate)
+        if result is not None:
+            return result, turns, effects
+
+        move = player_policy(board, moves + special_moves, player_rng)
+        turns += 1
+        if move in special_moves:
+            engine.play_special_move(game, move.from_square, move.to_square, opponent)
+            continue
+
+        ctx = engine.play_turn(game, move, opponent)
+        if ctx.random_move_applied:
+            effects.append('random_move')
+        if ctx.effect:
+            effects.append(ctx.effect)
+        if ctx.transform_square is not None:
+            effects.append('transform')
+    # 最后一回合可能已经分出胜负
+    result = game_result(board, player_color, list(board.legal_moves), adjudicate)
+    return result or adjudicated(board, player_color, adjudicate) or 'unfinished', turns, effects
+
+
+def parse_overrides(values):
+    """--override 表:评级=概率，表为变体名（D/E/F/G）或random（随机走位）
+
+    Returns:
+        {表: {评级: 概率}}
+    """
+    overrides = {}
+    for value in values or []:
+        try:
+            table, assignment = value.split(':', 1)
+            rank, probability = assignment.split('=', 1)
+            overrides.setdefault(table, {})[rank] = float(probability)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无法解析的覆盖设置: {value}（格式为 F:G=0.4）")
+        if table != 'random' and (table not in RULES or RULES[table].rank_probabilities is None):
+            raise argparse.ArgumentTypeError(f"变体{table}没有评级概率表")
+    return overrides
+
+
+def build_rules(overrides):
+    """在RULES的副本上应用概率覆盖，不修改模块中的概率表"""
+    rules = dict(RULES)
+    for name, table in overrides.items():
+        if name == 'random':
+            continue
+        rule = copy.copy(rules[name])
+        rule.rank_probabilities = dict(rule.rank_probabilities, **table)
+        rules[name] = rule
+    return rules
+
+
+# 每个工作进程的模拟环境，由init_worker创建
+_worker = None
+
+
+def init_worker(player, opponent, depth, skill_level, overrides):
+    """进程池的初始化函数: 创建规则引擎和AI引擎，规则和引擎的日志都写到stderr，模拟时不输出"""
+    global _worker
+    sys.stderr = open(os.devnull, "w")
+    stockfish = None
+    if opponent == 'stockfish':
+        stockfish = StockfishWrapper(depth=depth, parameters={"Threads": 1, "Hash": 16, "Skill Level": skill_level})
+    _worker = {
+        'engine': VariantEngine(build_rules(overrides)),
+        'player': POLICIES[player],
+        'opponent': POLICIES.get(opponent),
+        'stockfish': stockfish,
+        'random_move_probabilities': dict(RANDOM_MOVE_PROBABILITIES, **overrides.get('random', {})),
+    }
+
+
+def run_batch(variant, rank, first_seed, count, max_turns, adjudicate):
+    """模拟一批对局，返回该批的统计"""
+    stats = {'games': 0, 'turns': 0, 'effects': {}}
+    stats.update({result: 0 for result in RESULTS})
+    for seed in range(first_seed, first_seed + count):
+        result, turns, effects = play_game(
+            _worker['engine'], variant, rank, seed, _worker['player'], _worker['opponent'], max_turns,
+            _worker['random_move_probabilities'], adjudicate, _worker['stockfish'])
+        stats['games'] += 1
+        stats['turns'] += turns
+        stats[result] += 1
+        for effect in effects:
+            stats['effects'][effect] = stats['effects'].get(effect, 0) + 1
+    return variant, rank, stats
+
+
+def merge(total, stats):
+    for key, value in stats.items():
+        if key == 'effects':
+            for effect, count in value.items():
+                total['effects'][effect] = total['effects'].get(effect, 0) + count
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def report(totals, variants, ranks):
+    print(f"{'变体':<8}{'评级':<6}{'对局':>7}{'玩家胜':>9}{'AI胜':>9}{'和棋':>9}{'未结束':>9}{'平均回合':>10}  每局触发的效果")
+    for variant in variants:
+        for rank in ranks:
+            stats = totals.get((variant, rank))
+            if not stats:
+                continue
+            games = stats['games']
+            rates = [f"{stats[result] / games * 100:>8.1f}%" for result in RESULTS]
+            effects = ", ".join(f"{name} {count / games:.2f}" for name, count in sorted(stats['effects'].items()))
+            print(f"{variant:<8}{rank:<6}{games:>7}{''.join(rates)}{stats['turns'] / games:>10.1f}  {effects}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用变体规则代码离线模拟对局，统计各变体和评级下的胜率")
+    parser.add_argument("--games", type=int, default=1000, help="每个变体、每个评级模拟的对局数")
+    parser.add_argument("--variants", default="normal,A,B,D,E,F,G", help="逗号分隔的变体列表")
+    parser.add_argument("--ranks", default=",".join(RANDOM_MOVE_PROBABILITIES), help="逗号分隔的评级列表")
+    parser.add_argument("--player", choices=sorted(POLICIES), default="greedy", help="玩家的走棋策略")
+    parser.add_argument("--opponent", choices=sorted(POLICIES) + ["stockfish"], default="greedy", help="AI的走棋策略")
+    parser.add_argument("--depth", type=int, default=2, help="--opponent stockfish时的搜索深度")
+    parser.add_argument("--skill-level", type=int, default=5, help="--opponent stockfish时的技能等级")
+    parser.add_argument("--max-turns", type=int, default=150, help="每局玩家最多走的回合数")
+    parser.add_argument("--adjudicate", type=int, default=300,
+                        help="达到回合上限或75回合规则时，子力差（厘兵）不小于该值的一方判胜，0表示不判定")
+    parser.add_argument("--override", action="append", metavar="表:评级=概率",
+                        help="覆盖概率表中的一项，表为变体名或random，例如 F:G=0.4，可重复")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    parser.add_argument("--batch", type=int, default=50, help="每个任务包含的对局数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    variants = [v for v in args.variants.split(",") if v]
+    ranks = [r for r in args.ranks.split(",") if r]
+    for variant in variants:
+        if variant not in RULES:
+            parser.error(f"未知变体: {variant}")
+    try:
+        overrides = parse_overrides(args.override)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    # 不同变体和评级使用相同的种子序列，比较时可以排除对局本身的差异
+    tasks = [
+        (variant, rank, args.seed * 1_000_000 + start, min(args.batch, args.games - start),
+         args.max_turns, args.adjudicate)
+        for variant in variants for rank in ranks for start in range(0, args.games, args.batch)
+    ]
+    init_args = (args.player, args.opponent, args.depth, args.skill_level, overrides)
+
+    totals = {}
+    start_time = time.perf_counter()
+    if args.workers <= 1:
+        stderr = sys.stderr
+        init_worker(*init_args)
+        results = [run_batch(*task) for task in tasks]
+        sys.stderr = stderr
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=init_args) as pool:
+            results = list(pool.map(run_batch, *zip(*tasks)))
+    elapsed = time.perf_counter() - start_time
+
+    for variant, rank, stats in results:
+        merge(totals.setdefault((variant, rank), {'effects': {}}), stats)
+    report(totals, variants, ranks)
+    games = sum(stats['games'] for stats in totals.values())
+    print(f"共 {games} 局，用时 {elapsed:.1f} 秒（{games / elapsed:.0f} 局/秒，{args.workers} 个进程）")
+
+
+if __name__ == "__main__":
+    main()
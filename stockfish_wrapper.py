@@ -8,12 +8,26 @@ import sys
 import subprocess
 import time
 import atexit
+import queue
+import threading
 from pathlib import Path
 
+import chess
+
 class StockfishWrapper:
     """Stockfish引擎的简单包装器"""
     
-    def __init__(self, path=None, depth=10, parameters=None):
+    # 深度搜索的默认截止时间（秒），超时后发送stop
+    search_timeout = 30
+    
+    # 发送stop后等待bestmove的时间（秒）
+    stop_grace = 1
+    
+    # 延迟预算模式下留给通信和后续处理的比例，以及最短搜索时间（毫秒）
+    budget_margin = 0.2
+    min_movetime = 10
+    
+    def __init__(self, path=None, depth=10, parameters=None, cache=None, book=None):
         """
         初始化Stockfish引擎
         
@@ -21,6 +35,8 @@ class StockfishWrapper:
             path: Stockfish可执行文件的路径，如果为None则尝试自动查找
             depth: 搜索深度
             parameters: 引擎参数字典
+            cache: 可选的SearchCache，相同局面和设置的搜索直接返回缓存结果
+            book: 可选的OpeningBook，开局阶段优先使用库内走法
         """
         print("========== StockfishWrapper初始化开始 ===========", file=sys.stderr)
         print(f"Python工作目录: {os.getcwd()}", file=sys.stderr)
@@ -29,6 +45,16 @@ class StockfishWrapper:
         
         self.depth = depth
         self.parameters = parameters or {}
+        self.cache = cache
+        self.book = book
+        
+        # 当前请求的截止时间(time.monotonic())，由EnginePool在借出引擎时设置
+        self.request_deadline = None
+        
+        # 健康监控指标: 重启次数、最近一次重启原因和时间
+        self.restart_count = 0
+        self.last_restart_reason = None
+        self.last_restart_time = None
         
         # 查找Stockfish路径
         print("---------- 开始查找Stockfish路径 ----------", file=sys.stderr)
@@ -69,21 +95,11 @@ class StockfishWrapper:
             # 启动Stockfish进程
             print("\n---------- 尝试启动Stockfish进程 ----------", file=sys.stderr)
             print(f"使用绝对路径启动Stockfish: {os.path.abspath(self.stockfish_path)}", file=sys.stderr)
-            self.process = subprocess.Popen(
-                os.path.abspath(self.stockfish_path),  # 确保使用绝对路径
-                universal_newlines=True,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
+            self._start_process()
             
             # 确保进程在Python退出时关闭
             atexit.register(self.quit)
             
-            # 设置引擎参数
-            print("\n---------- 配置Stockfish引擎参数 ----------", file=sys.stderr)
-            self._configure_engine()
-            
             print("\n*** Stockfish引擎成功初始化 ***", file=sys.stderr)
         except Exception as e:
             print(f"\n*** 启动Stockfish引擎失败: {e} ***", file=sys.stderr)
@@ -105,6 +121,67 @@ class StockfishWrapper:
             
             raise
     
+    def _start_process(self):
+        """启动Stockfish进程和输出读取线程，并按self.parameters配置引擎"""
+        self.process = subprocess.Popen(
+            os.path.abspath(self.stockfish_path),  # 确保使用绝对路径
+            universal_newlines=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        
+        # 后台线程读取引擎输出并放入队列，读取方可以按截止时间等待
+        # 每个进程使用独立的队列，重启后旧进程迟到的输出和结束标记不会混入
+        self._output_queue = queue.Queue()
+        self._reader_thread = threading.Thread(
+            target=self._reader_loop,
+            args=(self.process.stdout, self._output_queue),
+            name="stockfish-reader",
+            daemon=True
+        )
+        self._reader_thread.start()
+        
+        # 新进程没有任何局面，下一次set_position必须重新发送
+        self._position = None
+        
+        # 设置引擎参数
+        print("\n---------- 配置Stockfish引擎参数 ----------", file=sys.stderr)
+        self._configure_engine()
+    
+    def is_alive(self):
+        """引擎进程是否仍在运行"""
+        return self.process is not None and self.process.poll() is None
+    
+    def ping(self, timeout=5):
+        """发送isready，在timeout秒内收到readyok视为引擎可以响应"""
+        if not self.is_alive():
+            return False
+        self._drain_output()
+        self._send_command("isready")
+        output = self._read_output_until("readyok", timeout=timeout)
+        return any(line == "readyok" for line in output)
+    
+    def restart(self, reason=""):
+        """结束当前进程并以相同参数（包括技能等级）重新启动
+        
+        原进程已崩溃或不再响应时由EnginePool的健康检查或search的重试逻辑调用
+        """
+        print(f"重启Stockfish引擎: {reason}", file=sys.stderr)
+        old_process = self.process
+        self.process = None
+        if old_process is not None:
+            try:
+                old_process.kill()
+                old_process.wait(timeout=self.stop_grace)
+            except Exception as e:
+                print(f"结束旧的Stockfish进程失败: {e}", file=sys.stderr)
+        
+        self.restart_count += 1
+        self.last_restart_reason = reason
+        self.last_restart_time = time.time()
+        self._start_process()
+    
     def _find_stockfish_path(self):
         """查找Stockfish引擎路径，使用简化的硬编码路径"""
         # 获取项目的绝对路径
@@ -187,32 +264,83 @@ class StockfishWrapper:
         except Exception as e:
             print(f"发送命令失败: {e}", file=sys.stderr)
     
+    @staticmethod
+    def _reader_loop(stdout, output_queue):
+        """读取引擎输出的后台线程，进程退出时放入None作为结束标记"""
+        try:
+            for line in stdout:
+                line = line.strip()
+                if line:
+                    output_queue.put(line)
+        except Exception as e:
+            print(f"读取引擎输出失败: {e}", file=sys.stderr)
+        finally:
+            output_queue.put(None)
+    
+    def _drain_output(self):
+        """丢弃队列中尚未读取的输出（例如超时搜索迟到的bestmove）"""
+        output = []
+        while True:
+            try:
+                line = self._output_queue.get_nowait()
+            except queue.Empty:
+                break
+            if line is None:
+                # 保留结束标记，后续读取可以立即发现进程已退出
+                self._output_queue.put(None)
+                break
+            output.append(line)
+        return output
+    
     def _read_output_until(self, marker=None, timeout=5):
-        """读取引擎输出直到遇到标记或超时"""
+        """读取引擎输出直到遇到标记或超时
+        
+        marker为None时只返回当前已经到达的输出，不会等待
+        """
+        if marker is None:
+            return self._drain_output()
+        
         output = []
-        start_time = time.time()
+        deadline = time.monotonic() + timeout
         
         while True:
-            if self.process.stdout.readable():
-                line = self.process.stdout.readline().strip()
-                if line:
-                    output.append(line)
-                    if marker and marker in line:
-                        break
-            
-            if marker is None:
-                break
-                
-            if time.time() - start_time > timeout:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
                 print(f"读取输出超时，未找到标记: {marker}", file=sys.stderr)
                 break
             
-            time.sleep(0.001)
+            try:
+                line = self._output_queue.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            
+            if line is None:
+                # 引擎进程已退出
+                self._output_queue.put(None)
+                print(f"Stockfish进程已退出，未找到标记: {marker}", file=sys.stderr)
+                break
+            
+            output.append(line)
+            if marker in line:
+                break
         
         return output
     
+    def stop(self):
+        """停止当前搜索，返回stop之后收到的输出（包含bestmove）"""
+        self._send_command("stop")
+        return self._read_output_until("bestmove", timeout=self.stop_grace)
+    
     def set_position(self, fen=None, moves=None):
-        """设置棋盘位置"""
+        """设置棋盘位置
+        
+        推荐传入起始FEN(或None表示初始局面)加完整走法列表，引擎可以据此判断重复局面；
+        与上一次设置的局面完全相同时不会重复发送
+        """
+        moves = list(moves or [])
+        if getattr(self, '_position', None) == (fen, moves):
+            return
+        
         position_cmd = "position"
         
         if fen:
@@ -222,23 +350,270 @@ class StockfishWrapper:
             
         if moves:
             position_cmd += f" moves {' '.join(moves)}"
+        
+        # 记录走棋方，用于把引擎给出的分数换算成白方视角
+        white_to_move = fen.split()[1] == 'w' if fen else True
+        if len(moves) % 2 == 1:
+            white_to_move = not white_to_move
+        self._white_to_move = white_to_move
+        self._position = (fen, moves)
             
         self._send_command(position_cmd)
     
-    def get_best_move(self, time_limit=None):
-        """获取最佳走法"""
-        if time_limit:
-            self._send_command(f"go movetime {time_limit}")
+    def search(self, time_limit=None, timeout=None, searchmoves=None):
+        """搜索当前局面，一次往返同时得到最佳走法、评估和主要变例
+        
+        设置了请求延迟预算(request_deadline)时，搜索同时受深度和剩余时间限制，
+        到截止时间仍未返回则发送stop
+        
+        Args:
+            time_limit: 搜索时间（毫秒），None时按深度搜索
+            timeout: 等待bestmove的截止时间（秒），超时后发送stop并取当前最佳走法
+            searchmoves: 只在这些UCI走法中搜索，None表示所有合法走法
+        
+        Returns:
+            {'bestmove': 'e2e4', 'evaluation': {'type': 'cp', 'value': 12}, 'pv': [...], 'depth': 15,
+             'limit_hit': 'depth', 'elapsed_ms': 35}
+            评估值为白方视角，与get_evaluation格式一致
+            limit_hit为 'book'、'cache'、'depth'、'movetime' 或 'deadline'（超时后被stop）
+        """
+        start_time = time.monotonic()
+        budget_ms = self._remaining_budget_ms() if time_limit is None else None
+        
+        if timeout is None:
+            if time_limit:
+                timeout = time_limit / 1000 + self.stop_grace
+            elif budget_ms is not None:
+                timeout = budget_ms / 1000
+            else:
+                timeout = self.search_timeout
+        
+        # 缓存中完整深度的结果对有预算的请求同样适用，因此预算模式也按深度查缓存
+        limit = f"movetime {time_limit}" if time_limit else f"depth {self.depth}"
+        
+        board = self._position_board() if self.book is not None or self.cache is not None else None
+        
+        # 开局库优先，限定走法的搜索（如变体E）不使用开局库
+        if self.book is not None and not searchmoves:
+            book_result = self.book.choose(board, self.parameters.get("Skill Level"))
+            if book_result is not None:
+                book_result['cached'] = False
+                book_result['limit_hit'] = 'book'
+                book_result['elapsed_ms'] = self._elapsed_ms(start_time)
+                return book_result
+        
+        cache_key = None
+        if self.cache is not None and self.cache.is_cacheable(board):
+            cache_key = self.cache.make_key(
+                board, self.parameters.get("Skill Level"), limit, searchmoves
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                cached['cached'] = True
+                cached['limit_hit'] = 'cache'
+                cached['elapsed_ms'] = self._elapsed_ms(start_time)
+                return cached
+        
+        output, deadline_hit, healthy = self._run_go(limit, budget_ms, searchmoves, timeout)
+        if not healthy and self._position is not None:
+            # 引擎进程崩溃或stop之后仍无响应: 以相同参数重启，重新发送局面后重试一次
+            fen, moves = self._position
+            self.restart("搜索时引擎崩溃或无响应")
+            self.set_position(fen=fen, moves=moves)
+            retry_budget_ms = self._remaining_budget_ms() if budget_ms is not None else None
+            output, deadline_hit, healthy = self._run_go(limit, retry_budget_ms, searchmoves, timeout)
+        
+        result = self._parse_search_output(output)
+        result['cached'] = False
+        if deadline_hit:
+            result['limit_hit'] = 'deadline'
+        elif time_limit or result['depth'] < self.depth:
+            result['limit_hit'] = 'movetime'
         else:
-            self._send_command(f"go depth {self.depth}")
+            result['limit_hit'] = 'depth'
+        result['elapsed_ms'] = self._elapsed_ms(start_time)
+        
+        # 只缓存完整达到搜索限制的结果，预算内被截断的浅层结果不缓存
+        cacheable = result['limit_hit'] == 'depth' or (time_limit and result['limit_hit'] == 'movetime')
+        if cache_key is not None and result['bestmove'] and cacheable:
+            self.cache.put(cache_key, result)
+        return result
+    
+    def _run_go(self, limit, budget_ms, searchmoves, timeout):
+        """发送go命令并等待bestmove
+        
+        Returns:
+            (output, deadline_hit, healthy)，healthy为False表示进程已退出或stop之后仍没有返回bestmove
+        """
+        go_cmd = f"go {limit}"
+        if budget_ms is not None:
+            # 给进程通信和后续处理留出余量，让引擎在预算内自行结束
+            movetime = max(self.min_movetime, int(budget_ms * (1 - self.budget_margin)))
+            go_cmd += f" movetime {movetime}"
+        if searchmoves:
+            go_cmd += f" searchmoves {' '.join(searchmoves)}"
+        
+        self._drain_output()
+        self._send_command(go_cmd)
             
-        output = self._read_output_until("bestmove")
+        output = self._read_output_until("bestmove", timeout=timeout)
+        deadline_hit = not self._has_bestmove(output)
+        if deadline_hit and self.is_alive():
+            print(f"搜索超过截止时间 {timeout} 秒，发送stop", file=sys.stderr)
+            output += self.stop()
         
+        healthy = self.is_alive() and self._has_bestmove(output)
+        return output, deadline_hit, healthy
+    
+    @staticmethod
+    def _has_bestmove(output):
+        return any(line.startswith("bestmove") for line in output)
+    
+    def _remaining_budget_ms(self):
+        """当前请求剩余的延迟预算（毫秒），没有预算时返回None"""
+        if self.request_deadline is None:
+            return None
+        return max(0.0, (self.request_deadline - time.monotonic()) * 1000)
+    
+    @staticmethod
+    def _elapsed_ms(start_time):
+        return int((time.monotonic() - start_time) * 1000)
+    
+    def search_excluding(self, excluded_from_squares, time_limit=None, timeout=None):
+        """搜索不从指定格子出发的最佳走法（例如避开被冻结的棋子），只需一次搜索
+        
+        Args:
+            excluded_from_squares: 不允许移动的棋子所在格子，如 ['e4']
+        
+        Returns:
+            与search相同的结果；没有允许的走法时bestmove为None
+        """
+        excluded = set(excluded_from_squares)
+        allowed = [
+            move.uci() for move in self._position_board().legal_moves
+            if chess.square_name(move.from_square) not in excluded
+        ]
+        if not allowed:
+            return {'bestmove': None, 'evaluation': {'type': 'cp', 'value': 0}, 'pv': [], 'depth': 0, 'lines': []}
+        return self.search(time_limit=time_limit, timeout=timeout, searchmoves=allowed)
+    
+    def _position_board(self):
+        """根据最近一次set_position得到棋盘
+        
+        起始FEN相同且走法列表只是在上次基础上追加时，只补走新增的走法；
+        进程启动或重启后还没有设置局面时（_position为None）按初始局面处理，与引擎一致；
+        返回的棋盘只保留最近一步不可逆走法之后的走法历史，足够判断重复局面
+        """
+        fen, moves = getattr(self, '_position', None) or (None, [])
+        cached = getattr(self, '_board_cache', None)
+        if cached and cached[0] == fen and moves[:len(cached[1])] == cached[1]:
+            board = cached[2]
+            new_moves = moves[len(cached[1]):]
+        else:
+            board = chess.Board(fen) if fen else chess.Board()
+            new_moves = moves
+        for move in new_moves:
+            board.push_uci(move)
+        self._board_cache = (fen, list(moves), board)
+        return board.copy(stack=board.halfmove_clock)
+    
+    def _parse_search_output(self, output):
+        """解析 info ... score cp|mate ... pv 行和 bestmove 行"""
+        result = {'bestmove': None, 'evaluation': {'type': 'cp', 'value': 0}, 'pv': [], 'depth': 0, 'lines': []}
+        
+        # 技能等级较低时引擎会输出多条变例(multipv)，按编号保留每条变例最新的信息
+        lines_by_multipv = {}
         for line in output:
             if line.startswith("bestmove"):
-                return line.split()[1]
+                parts = line.split()
+                if len(parts) > 1 and parts[1] != "(none)":
+                    result['bestmove'] = parts[1]
+                continue
+            
+            if not line.startswith("info") or " score " not in line:
+                continue
+            
+            tokens = line.split()
+            info = {'multipv': 1}
+            try:
+                i = 1
+                while i < len(tokens):
+                    token = tokens[i]
+                    if token in ("depth", "multipv"):
+                        info[token] = int(tokens[i + 1])
+                        i += 2
+                    elif token == "score":
+                        info['score_type'] = tokens[i + 1]
+                        info['score_value'] = int(tokens[i + 2])
+                        i += 3
+                    elif token in ("lowerbound", "upperbound"):
+                        info['bound'] = True
+                        i += 1
+                    elif token == "pv":
+                        info['pv'] = tokens[i + 1:]
+                        break
+                    else:
+                        i += 1
+            except (IndexError, ValueError) as e:
+                print(f"解析搜索信息时出错: {e} ({line})", file=sys.stderr)
+                continue
+            
+            if 'score_type' in info and not info.get('bound'):
+                lines_by_multipv[info['multipv']] = info
         
-        return None
+        if not lines_by_multipv:
+            return result
+        
+        # 优先使用与bestmove对应的变例，否则使用第一条变例
+        chosen = lines_by_multipv.get(1) or next(iter(lines_by_multipv.values()))
+        for info in lines_by_multipv.values():
+            if info.get('pv') and info['pv'][0] == result['bestmove']:
+                chosen = info
+                break
+        
+        result['evaluation'] = self._white_evaluation(chosen)
+        result['pv'] = chosen.get('pv', [])
+        result['depth'] = chosen.get('depth', 0)
+        
+        # 保留每条变例的首步和评估，供开局库生成等需要多个候选走法的场景使用
+        result['lines'] = [
+            {'move': info['pv'][0], 'evaluation': self._white_evaluation(info)}
+            for _, info in sorted(lines_by_multipv.items())
+            if info.get('pv')
+        ]
+        return result
+    
+    def _white_evaluation(self, info):
+        """引擎分数是走棋方视角，换算为白方视角"""
+        value = info['score_value']
+        if not getattr(self, '_white_to_move', True):
+            value = -value
+        return {'type': info['score_type'], 'value': value}
+    
+    def get_best_move(self, time_limit=None, timeout=None):
+        """获取最佳走法，需要评估和变例时使用search"""
+        return self.search(time_limit=time_limit, timeout=timeout)['bestmove']
+    
+    def warm_up(self, depth=8):
+        """预热引擎：清空并触碰哈希表页面、加载NNUE网络，避免第一个真实请求承担这些开销"""
+        start_time = time.monotonic()
+        self._drain_output()
+        # ucinewgame会清空置换表，哈希表的内存页因此全部被分配
+        self._send_command("ucinewgame")
+        self._send_command("isready")
+        self._read_output_until("readyok", timeout=self.search_timeout)
+        # 一次浅层搜索会加载NNUE网络并初始化搜索线程
+        self._send_command("position startpos")
+        self._send_command(f"go depth {depth}")
+        self._read_output_until("bestmove", timeout=self.search_timeout)
+        # 引擎当前局面已被改变，下一次set_position必须重新发送
+        self._position = None
+        print(f"Stockfish预热完成，用时 {self._elapsed_ms(start_time)} 毫秒", file=sys.stderr)
+    
+    def set_option(self, name, value):
+        """设置任意UCI引擎参数"""
+        self.parameters[name] = value
+        self._send_command(f"setoption name {name} value {value}")
     
     def set_skill_level(self, skill_level):
         """设置技能等级 (0-20)"""
@@ -250,45 +625,12 @@ class StockfishWrapper:
         self._send_command(f"setoption name Skill Level value {skill_level}")
     
     def get_evaluation(self):
-        """获取当前局面的评估
+        """获取当前局面的评估（基于搜索，而不是静态的eval命令）
         
         返回格式与原始Stockfish包兼容: {'type': 'cp', 'value': 12}
+        只在局面被变体规则直接修改、没有现成搜索结果时才需要调用
         """
-        self._send_command("eval")
-        output = self._read_output_until(None)
-        
-        # 默认评估
-        evaluation = {'type': 'cp', 'value': 0}
-        
-        # 尝试从输出中解析评估值
-        for line in output:
-            if "Final evaluation" in line:
-                try:
-                    # 解析评估值，例如 "Final evaluation: +0.25 (white side)"
-                    parts = line.split()
-                    value_str = parts[2]
-                    if value_str.startswith("+"):
-                        value_str = value_str[1:]
-                    value = float(value_str) * 100  # 转换为厘兵值
-                    
-                    if "(white side)" in line:
-                        evaluation = {'type': 'cp', 'value': int(value)}
-                    else:
-                        evaluation = {'type': 'cp', 'value': -int(value)}
-                    break
-                except Exception as e:
-                    print(f"解析评估值时出错: {e}", file=sys.stderr)
-            elif "mate" in line.lower():
-                try:
-                    # 尝试解析将军步数
-                    if "Mate in" in line:
-                        mate_in = int(line.split("Mate in")[1].strip().split()[0])
-                        evaluation = {'type': 'mate', 'value': mate_in}
-                    break
-                except Exception as e:
-                    print(f"解析将军步数时出错: {e}", file=sys.stderr)
-        
-        return evaluation
+        return self.search()['evaluation']
     
     def quit(self):
         """关闭引擎"""
@@ -0,0 +1,264 @@
+"""
+Twitter请求调度
+令牌桶控制发往Twitter的请求速率；guest token池按每个token剩余的限额轮换使用，
+限额用完的token等到重置时间后再用，请求失败时按指数退避加随机抖动重试
+"""
+
+import asyncio
+import random
+import time
+
+
+def backoff_delay(attempt, base=0.5, cap=30):
+    """第attempt次重试前的等待时间（秒），full jitter: 在 [0, min(cap, base * 2^attempt)] 中随机取值"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class TokenBucket:
+    """异步令牌桶，rate为每秒补充的令牌数，capacity为允许的突发量
+
+    令牌不足时记为欠账，后来的请求依次排在前面请求之后，不会同时醒来
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            delay = -self._tokens / self.rate
+            self.waits += 1
+            self.waited_seconds += delay
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'capacity': self.capacity,
+            'waits': self.waits,
+            'waited_seconds': round(self.waited_seconds, 3),
+        }
+
+
+class GuestToken:
+    """一个guest token及其当前限额窗口"""
+
+    def __init__(self, value, ttl):
+        self.value = value
+        self.expires_at = time.time() + ttl
+        # 当前窗口的剩余限额，未知（尚未收到响应头或窗口已重置）时为None
+        self.remaining = None
+        self.reset_at = 0.0
+        # 已发出但还没有收到响应的请求数
+        self.in_flight = 0
+        self.requests = 0
+
+    def capacity(self, now, reserve):
+        """现在还能再发出的请求数
+
+        限额未知时只允许一个请求在途，用它的响应头探明限额
+        """
+        if now >= self.expires_at:
+            return 0
+        if self.remaining is None or now >= self.reset_at:
+            return 1 - self.in_flight
+        return self.remaining - self.in_flight - reserve
+
+    def exhausted(self, now, reserve):
+        """限额已用完，只能等重置时间或换token"""
+        return self.remaining is not None and now < self.reset_at and self.remaining <= reserve
+
+
+class GuestTokenPool:
+    """guest token池
+
+    token在第一次需要时才获取；每次选择剩余限额最多的token；所有token都用完时先换一个新token，
+    获取失败则等到最早的重置时间；临近过期的token在后台提前替换。同一时刻只有一个获取请求，并发调用方共享结果
+    """
+
+    def __init__(self, activate, size=3, ttl=3 * 3600, refresh_margin=600, reserve=1, max_wait=60):
+        """
+        Args:
+            activate: 获取新guest token的协程函数
+            size: 池中最多保留的token数
+            ttl: token的有效期（秒）
+            refresh_margin: 提前多久在后台替换即将过期的token（秒）
+            reserve: 剩余限额不高于该值的token视为已用完
+            max_wait: 所有token都用完时单次等待的最长时间（秒）
+        """
+        self._activate_fn = activate
+        self.size = size
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.reserve = reserve
+        self.max_wait = max_wait
+
+        self._tokens = []
+        self._activation = None
+        self._replacement = None
+        self._released = None
+
+        self.activations = 0
+        self.activation_failures = 0
+        self.rate_limited = 0
+        self.discarded = 0
+        self.waits = 0
+
+    async def acquire(self):
+        """返回一个可以使用的token，用完后必须调用release"""
+        while True:
+            now = time.time()
+            self._tokens = [t for t in self._tokens if now < t.expires_at]
+            self._schedule_replacement(now)
+
+            usable = [t for t in self._tokens if t.capacity(now, self.reserve) > 0]
+            if usable:
+                token = max(usable, key=lambda t: t.capacity(now, self.reserve))
+                token.in_flight += 1
+                token.requests += 1
+                return token
+
+            if len(self._tokens) < self.size:
+                await self.add_token()
+                continue
+
+            # 还有token只是请求在途，等待某个请求返回
+            if not all(t.exhausted(now, self.reserve) for t in self._tokens):
+                self.waits += 1
+                await self._wait_for_release()
+                continue
+
+            # 所有token都用完: 已有获取请求时等它完成，否则丢掉重置时间最晚的一个换成新token
+            if self._activation is not None and not self._activation.done():
+                try:
+                    await self.add_token()
+                except Exception:
+                    pass
+                continue
+            latest = max(self._tokens, key=lambda t: t.reset_at)
+            self._tokens.remove(latest)
+            try:
+                await self.add_token()
+                continue
+            except Exception:
+                self._tokens.append(latest)
+
+            wait = min(t.reset_at for t in self._tokens) - now
+            self.waits += 1
+            await asyncio.sleep(min(max(wait, 0.05), self.max_wait))
+
+    async def add_token(self):
+        """获取一个新token加入池中（单飞）"""
+        task = self._activation
+        if task is None or task.done():
+            task = self._activation = asyncio.get_running_loop().create_task(self._activate())
+        return await asyncio.shield(task)
+
+    async def _activate(self):
+        try:
+            value = await self._activate_fn()
+        except Exception:
+            self.activation_failures += 1
+            raise
+        self.activations += 1
+        token = GuestToken(value, self.ttl)
+        self._tokens.append(token)
+        # 超出容量时丢弃最早过期的token
+        while len(self._tokens) > self.size:
+            self._tokens.remove(min(self._tokens, key=lambda t: t.expires_at))
+        return token
+
+    def _schedule_replacement(self, now):
+        """临近过期的token在后台替换，替换期间仍可继续使用"""
+        if self._replacement is not None and not self._replacement.done():
+            return
+        expiring = [t for t in self._tokens if t.expires_at - self.refresh_margin <= now]
+        if expiring:
+            self._replacement = asyncio.get_running_loop().create_task(self._replace(expiring[0]))
+            self._replacement.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _replace(self, old):
+        await self.add_token()
+        if old in self._tokens:
+            self._tokens.remove(old)
+
+    async def renew(self, stale_value=None):
+        """丢弃stale_value对应的token（None时不丢弃）并获取一个新token"""
+        for token in list(self._tokens):
+            if token.value == stale_value:
+                self.discard(token)
+        token = await self.add_token()
+        return token.value
+
+    async def _wait_for_release(self):
+        if self._released is None:
+            self._released = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._released.wait(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+
+    def release(self, token, headers=None):
+        """请求结束（无论成功与否），有响应头时更新限额"""
+        token.in_flight = max(0, token.in_flight - 1)
+        if headers is not None:
+            self.update(token, headers)
+        if self._released is not None:
+            # 唤醒所有等待者重新选择token，之后换一个新的Event给下一轮等待
+            self._released.set()
+            self._released = None
+
+    def update(self, token, headers):
+        """根据响应头 x-rate-limit-remaining / x-rate-limit-reset 更新token的限额"""
+        try:
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset_at = float(headers["x-rate-limit-reset"])
+        except (KeyError, ValueError):
+            return
+        token.remaining = remaining
+        token.reset_at = reset_at
+
+    def mark_exhausted(self, token, headers=None):
+        """收到429后，该token在重置前不再使用"""
+        self.rate_limited += 1
+        if headers is not None:
+            self.update(token, headers)
+        token.remaining = 0
+        if token.reset_at <= time.time():
+            # 没有给出重置时间时按Twitter的15分钟窗口计算
+            token.reset_at = time.time() + 15 * 60
+
+    def discard(self, token):
+        """token失效（401/403）时移出池"""
+        if token in self._tokens:
+            self._tokens.remove(token)
+            self.discarded += 1
+
+    def stats(self):
+        now = time.time()
+        return {
+            'size': self.size,
+            'tokens': [
+                {
+                    'remaining': t.remaining,
+                    'in_flight': t.in_flight,
+                    'reset_in': max(0, round(t.reset_at - now)) if t.remaining is not None else None,
+                    'expires_in': round(t.expires_at - now),
+                    'requests': t.requests,
+                }
+                for t in self._tokens
+            ],
+            'activations': self.activations,
+            'activation_failures': self.activation_failures,
+            'rate_limited': self.rate_limited,
+            'discarded': self.discarded,
+            'waits': self.waits,
+        }
@@ -0,0 +1,588 @@
+"""
+变体规则引擎
+每个变体是一个规则对象，/move 按固定顺序调用它的钩子:
+    pre_move   玩家走棋之前（变体G判断吃子后是否转化）
+    post_move  玩家走棋之后、AI搜索之前（变体F判断是否获得额外回合）
+    search     选择AI走法（变体E避开被冻结的棋子）
+    post_ai    AI走法执行之后（变体D自爆、变体E冻结、变体F交还回合、变体G重生）
+随机走位（原变体C）对所有变体生效，由VariantEngine统一处理。
+棋子类别的判断直接使用棋盘的位棋盘掩码，各评级的触发概率在模块加载时查表得到
+"""
+
+import sys
+
+import chess
+
+import move_log
+
+# 用户评级 -> 随机走位概率（对所有变体生效）
+RANDOM_MOVE_PROBABILITIES = {
+    'A': 0.0,   # 1级
+    'B': 0.1,   # 2级
+    'C': 0.2,   # 3级
+    'D': 0.25,  # 4级
+    'E': 0.30,  # 5级
+    'F': 0.37,  # 6级
+    'G': 0.38,  # 未评级的默认值
+}
+
+# 用户评级 -> 各变体效果的触发概率
+VANISH_PROBABILITIES = {'A': 0.0, 'B': 0.15, 'C': 0.17, 'D': 0.20, 'E': 0.24, 'F': 0.35, 'G': 0.37}
+FREEZE_PROBABILITIES = {'A': 0.0, 'B': 0.17, 'C': 0.25, 'D': 0.30, 'E': 0.35, 'F': 0.45, 'G': 0.47}
+BONUS_MOVE_PROBABILITIES = {'A': 0.0, 'B': 0.15, 'C': 0.17, 'D': 0.20, 'E': 0.25, 'F': 0.35, 'G': 0.37}
+TRANSFORM_PROBABILITIES = {'A': 0.0, 'B': 0.15, 'C': 0.18, 'D': 0.23, 'E': 0.28, 'F': 0.35, 'G': 0.37}
+
+# 变体G最大转化次数
+MAX_TRANSFORMS = 3
+
+
+def piece_mask(board, piece_types, color):
+    """color一方piece_types类棋子的位棋盘"""
+    mask = 0
+    for piece_type in piece_types:
+        mask |= board.pieces_mask(piece_type, color)
+    return mask
+
+
+def shift(bb, delta):
+    """把位棋盘整体平移delta格（正数向上/向右，负数向下/向左）"""
+    return (bb << delta) & chess.BB_ALL if delta > 0 else bb >> -delta
+
+
+def generate_steps(board, movers, steps):
+    """movers中的棋子沿steps中的方向走一格到空格的走法，只保留走完后己方国王不被将军的走法
+
+    走法既不吃子也不移动国王，因此只需检查两种情况: 被牵制的棋子只能沿牵制线移动；
+    被将军时只能挡在国王和唯一的远程将军棋子之间
+
+    Args:
+        movers: 走棋方可以这样走的棋子位棋盘
+        steps: (位移, 目标格掩码) 列表，掩码用于排除横向越过棋盘边缘的目标格
+    """
+    us = board.turn
+    king = board.king(us)
+    checkers = board.checkers_mask()
+    if checkers:
+        if chess.popcount(checkers) > 1:
+            return
+        # 吃子不可能，马和兵的将军因此无法解除（between返回0）
+        evasion_mask = chess.between(king, chess.msb(checkers))
+    else:
+        evasion_mask = chess.BB_ALL
+    empty = chess.BB_ALL & ~board.occupied
+
+    for from_square in chess.scan_forward(movers):
+        from_bb = chess.BB_SQUARES[from_square]
+        targets = 0
+        for delta, target_mask in steps:
+            targets |= shift(from_bb, delta) & target_mask
+        targets &= empty & evasion_mask & board.pin_mask(us, from_square)
+        for to_square in chess.scan_forward(targets):
+            yield chess.Move(from_square, to_square)
+
+
+class TurnContext:
+    """一次 /move 请求中各钩子共享的状态"""
+
+    __slots__ = (
+        'game', 'board', 'rng', 'player_color', 'requested_move', 'move', 'captured_piece',
+        'random_move_applied', 'random_move_msg',
+        'search_result', 'ai_move', 'ai_to_square', 'captured_by_ai', 'ai_move_applied', 'skip_ai_move',
+        'ai_piece_frozen', 'ai_log_flags', 'ai_log_square',
+        'effect', 'effect_msg', 'board_edited', 'bonus_square',
+        'transform_piece_type', 'transform_square', 'transform_msg', 'evaluation',
+    )
+
+    def __init__(self, game, move):
+        self.game = game
+        self.board = game.board
+        # 本局的随机数序列（GameState.rng），同一种子下每个回合的随机判定顺序固定
+        self.rng = game.rng
+        self.player_color = game.board.turn
+        # 玩家选择的走法，以及随机走位之后实际执行的走法
+        self.requested_move = move
+        self.move = move
+        # 玩家选择的目标格上被吃的棋子（随机走位之前）
+        self.captured_piece = game.board.piece_at(move.to_square)
+
+        self.random_move_applied = False
+        self.random_move_msg = ""
+
+        self.search_result = None
+        self.ai_move = None
+        self.ai_to_square = None
+        # AI走法目标格上被吃的玩家棋子
+        self.captured_by_ai = None
+        self.ai_move_applied = False
+        # 变体F额外回合时AI这一步不执行
+        self.skip_ai_move = False
+        # 变体E: AI避开被冻结棋子走棋
+        self.ai_piece_frozen = False
+        # 写入走法记录的AI走法附加标志和格子
+        self.ai_log_flags = 0
+        self.ai_log_square = None
+
+        # 'frozen' / 'frozen_move' / 'bonus_move' / 'vanish'，没有效果时为None
+        self.effect = None
+        self.effect_msg = ""
+        # 变体效果在走法之外修改了棋盘，需要重新评估
+        self.board_edited = False
+        self.bonus_square = None
+
+        # 变体G: 被转化的棋子类型及重生位置
+        self.transform_piece_type = None
+        self.transform_square = None
+        self.transform_msg = ""
+
+        self.evaluation = None
+
+    @property
+    def user_rank(self):
+        return self.game.current_match_info.get('user_rank')
+
+    @property
+    def opponent_color(self):
+        return not self.player_color
+
+
+class VariantRule:
+    """常规规则，同时是各变体规则的基类"""
+
+    name = 'normal'
+    # 各评级的触发概率，None表示该变体没有概率效果
+    rank_probabilities = None
+
+    def probability(self, ctx):
+        return self.rank_probabilities.get(ctx.user_rank, 0.0) if self.rank_probabilities else 0.0
+
+    def roll(self, ctx):
+        """按当前用户评级的概率判断效果是否触发"""
+        return ctx.rng.random() < self.probability(ctx)
+
+    def generate_special_moves(self, board, from_mask=chess.BB_ALL):
+        """走棋方在该变体下除标准走法之外的合法特殊走法"""
+        return iter(())
+
+    def special_move_target(self, board, move, rng):
+        """variant_move请求: 返回棋子实际到达的格子，不符合该变体的特殊走法时返回None"""
+        for special in self.generate_special_moves(board, chess.BB_SQUARES[move.from_square]):
+            if special.to_square == move.to_square:
+                return move.to_square
+        return None
+
+    def pre_move(self, ctx):
+        pass
+
+    def post_move(self, ctx):
+        pass
+
+    def search(self, ctx, stockfish):
+        return stockfish.search()
+
+    def post_ai(self, ctx):
+        pass
+
+    def annotate(self, ctx, response):
+        """把ctx.effect对应的信息加入响应"""
+        response['special_effect'] = ctx.effect
+        response['special_effect_msg'] = ctx.effect_msg
+
+
+class PawnDiagonalRule(VariantRule):
+    """A: 兵可以斜着向前走一格到空格（不升变）"""
+
+    name = 'A'
+    # 白兵向上（+7左上、+9右上），黑兵向下（-9左下、-7右下）
+    steps = {
+        chess.WHITE: ((7, ~chess.BB_FILE_H), (9, ~chess.BB_FILE_A)),
+        chess.BLACK: ((-9, ~chess.BB_FILE_H), (-7, ~chess.BB_FILE_A)),
+    }
+
+    def generate_special_moves(self, board, from_mask=chess.BB_ALL):
+        movers = board.pawns & board.occupied_co[board.turn] & from_mask
+        return generate_steps(board, movers, self.steps[board.turn])
+
+
+class BishopStepRule(VariantRule):
+    """B: 象可以横向或纵向走一格到空格"""
+
+    name = 'B'
+    steps = ((8, chess.BB_ALL), (-8, chess.BB_ALL), (1, ~chess.BB_FILE_A), (-1, ~chess.BB_FILE_H))
+
+    def generate_special_moves(self, board, from_mask=chess.BB_ALL):
+        movers = board.bishops & board.occupied_co[board.turn] & from_mask
+        return generate_steps(board, movers, self.steps)
+
+
+class LegacyRandomRule(VariantRule):
+    """C: 旧的随机走法变体，合法走法有50%几率改走同一棋子的另一个合法走法
+
+    随机走位已经对所有变体生效，这里只保留旧前端发送的variant_move请求
+    """
+
+    name = 'C'
+
+    def special_move_target(self, board, move, rng):
+        move = chess.Move(move.from_square, move.to_square)
+        if not board.is_legal(move):
+            return None
+        if rng.random() < 0.5:
+            others = [m for m in board.generate_legal_moves(from_mask=chess.BB_SQUARES[move.from_square]) if m != move]
+            if others:
+                return rng.choice(others).to_square
+        return move.to_square
+
+
+class VanishRule(VariantRule):
+    """D: AI吃掉玩家的车/马/象/后后，吃子的AI棋子有一定几率自爆"""
+
+    name = 'D'
+    rank_probabilities = VANISH_PROBABILITIES
+    target_types = (chess.ROOK, chess.KNIGHT, chess.BISHOP, chess.QUEEN)
+
+    def post_ai(self, ctx):
+        captured = ctx.captured_by_ai
+        if captured is None or captured.color != ctx.player_color or captured.piece_type not in self.target_types:
+            return
+        if not self.roll(ctx):
+            return
+
+        vanish_piece = ctx.game.remove_piece(ctx.ai_to_square)
+        if vanish_piece is None:
+            return
+        ctx.board_edited = True
+        ctx.effect = 'vanish'
+        ctx.effect_msg = (f"报应！AI的{chess.piece_name(vanish_piece.piece_type)}吃掉了您的"
+                          f"{chess.piece_name(captured.piece_type)}后发生自爆！")
+        ctx.ai_log_flags |= move_log.FLAG_VANISH
+        ctx.ai_log_square = ctx.ai_to_square
+        print(f"变体D: AI棋子在{chess.square_name(ctx.ai_to_square)}位置自爆，已移除", file=sys.stderr)
+
+
+class FreezeRule(VariantRule):
+    """E: AI吃掉玩家棋子后，吃子的AI棋子有一定几率被冻结一回合，回合交还玩家"""
+
+    name = 'E'
+    rank_probabilities = FREEZE_PROBABILITIES
+
+    def search(self, ctx, stockfish):
+        game = ctx.game
+        frozen = game.frozen_piece_square
+        if frozen is None:
+            return stockfish.search()
+
+        # 不论是否找到避开的走法，冻结只持续这一回合
+        game.frozen_piece_square = None
+        if any(ctx.board.generate_legal_moves(from_mask=chess.BB_ALL & ~chess.BB_SQUARES[frozen])):
+            # 只在不移动被冻结棋子的走法中搜索（一次搜索，而不是逐个评估）
+            result = stockfish.search_excluding([chess.square_name(frozen)])
+            if result['bestmove']:
+                ctx.ai_piece_frozen = True
+                ctx.effect = 'frozen_move'
+                ctx.effect_msg = f"AI的棋子在 {chess.square_name(frozen)} 位置被冻结，无法移动！"
+                ctx.ai_log_flags |= move_log.FLAG_FROZEN_MOVE
+                return result
+        return stockfish.search()
+
+    def post_ai(self, ctx):
+        captured = ctx.captured_by_ai
+        # 避开冻结棋子的这一步不会再次触发冻结
+        if ctx.ai_piece_frozen or captured is None or captured.color != ctx.player_color:
+            return
+        if not self.roll(ctx):
+            return
+
+        ctx.game.frozen_piece_square = ctx.ai_to_square
+        ctx.game.set_turn(ctx.player_color)
+        ctx.board_edited = True
+        ctx.effect = 'frozen'
+        ctx.effect_msg = f"AI的棋子在 {chess.square_name(ctx.ai_to_square)} 位置被冻结，无法移动！轮到您继续下棋。"
+        ctx.ai_log_flags |= move_log.FLAG_FREEZE
+        ctx.ai_log_square = ctx.ai_to_square
+        print(f"变体E: AI棋子在 {chess.square_name(ctx.ai_to_square)} 被冻结，回合返回给玩家", file=sys.stderr)
+
+    def annotate(self, ctx, response):
+        super().annotate(ctx, response)
+        board = ctx.board
+        if ctx.effect == 'frozen':
+            response['turn_override'] = True
+        response['next_player'] = 'white' if board.turn == chess.WHITE else 'black'
+        response['legal_moves_debug'] = [m.uci() for m in board.legal_moves]
+
+
+class BonusMoveRule(VariantRule):
+    """F: 玩家的车/马/象吃子后有一定几率获得额外回合，额外回合中只有这个棋子可以移动"""
+
+    name = 'F'
+    rank_probabilities = BONUS_MOVE_PROBABILITIES
+    attacker_types = (chess.ROOK, chess.KNIGHT, chess.BISHOP)
+
+    def post_move(self, ctx):
+        if ctx.captured_piece is None:
+            return
+        game = ctx.game
+        attacker = piece_mask(ctx.board, self.attacker_types, ctx.player_color) & chess.BB_SQUARES[ctx.move.to_square]
+        if attacker and not game.is_bonus_move_round and self.roll(ctx):
+            ctx.skip_ai_move = True
+            ctx.bonus_square = ctx.move.to_square
+            game.bonus_move_piece_square = ctx.move.to_square
+            game.is_bonus_move_round = True
+            piece_name = chess.piece_name(ctx.board.piece_type_at(ctx.move.to_square))
+            ctx.effect = 'bonus_move'
+            ctx.effect_msg = (f"幸运! 您的{piece_name}在{chess.square_name(ctx.move.to_square)}位置获得了一次额外的走棋机会! "
+                              f"只有这个{piece_name}可以移动。")
+            print(f"变体F: 连续走棋效果触发 ({chess.square_name(ctx.move.to_square)})", file=sys.stderr)
+        else:
+            # 额外回合中再次吃子不会连续触发
+            game.is_bonus_move_round = False
+            game.bonus_move_piece_square = None
+
+    def post_ai(self, ctx):
+        if ctx.effect == 'bonus_move':
+            # AI这一步没有执行，把回合交还玩家
+            ctx.game.set_turn(ctx.player_color)
+            ctx.board_edited = True
+
+    def annotate(self, ctx, response):
+        super().annotate(ctx, response)
+        response['turn_override'] = True
+        response['next_player'] = 'white' if ctx.player_color == chess.WHITE else 'black'
+        response['legal_moves_debug'] = [m.uci() for m in ctx.board.legal_moves]
+        if ctx.game.bonus_move_piece_square is not None:
+            response['bonus_move_piece'] = chess.square_name(ctx.game.bonus_move_piece_square)
+
+
+class TransformRule(VariantRule):
+    """G: 玩家的车/马/象吃掉敌方的兵/车/马/象后，有一定几率把它变成己方棋子并重生在随机空格"""
+
+    name = 'G'
+    rank_probabilities = TRANSFORM_PROBABILITIES
+    attacker_types = (chess.ROOK, chess.KNIGHT, chess.BISHOP)
+    target_types = (chess.PAWN, chess.ROOK, chess.KNIGHT, chess.BISHOP)
+    max_transforms = MAX_TRANSFORMS
+
+    def pre_move(self, ctx):
+        captured = ctx.captured_piece
+        if captured is None or captured.color == ctx.player_color or captured.piece_type not in self.target_types:
+            return
+        if not piece_mask(ctx.board, self.attacker_types, ctx.player_color) & chess.BB_SQUARES[ctx.move.from_square]:
+            return
+        game = ctx.game
+        if game.variant_g_transform_count >= self.max_transforms or not self.roll(ctx):
+            return
+        ctx.transform_piece_type = captured.piece_type
+        game.variant_g_transform_count += 1
+        print(f"变体G: 棋子转换效果触发，已触发 {game.variant_g_transform_count}/{self.max_transforms} 次", file=sys.stderr)
+
+    def post_ai(self, ctx):
+        if ctx.transform_piece_type is None:
+            return
+        empty = chess.SquareSet(chess.BB_ALL & ~ctx.board.occupied)
+        if not empty:
+            return
+        square = ctx.rng.choice(list(empty))
+        ctx.game.place_piece(square, chess.Piece(ctx.transform_piece_type, ctx.player_color))
+        ctx.board_edited = True
+        ctx.transform_square = square
+        piece_name = chess.piece_name(ctx.transform_piece_type)
+        ctx.transform_msg = (f"魔法转换! 敌方的{piece_name}被转化为您的{piece_name}，并重生在{chess.square_name(square)}位置！"
+                             f"(已触发{ctx.game.variant_g_transform_count}/{self.max_transforms}次)")
+        print(f"变体G: 在{chess.square_name(square)}位置放置了新的{piece_name}", file=sys.stderr)
+
+
+RULES = {rule.name: rule for rule in (
+    VariantRule(), PawnDiagonalRule(), BishopStepRule(), LegacyRandomRule(),
+    VanishRule(), FreezeRule(), BonusMoveRule(), TransformRule(),
+)}
+
+
+class VariantEngine:
+    """按当前变体的规则执行一个完整回合: 玩家走棋、随机走位、AI应答和变体效果"""
+
+    def __init__(self, rules=None):
+        """
+        Args:
+            rules: 变体名 -> 规则对象，默认RULES
+
+        随机数来自每局棋自己的GameState.rng，不同棋局互不影响
+        """
+        self.rules = dict(rules or RULES)
+
+    def rule_for(self, variant):
+        return self.rules.get(variant) or self.rules['normal']
+
+    def legal_moves(self, game):
+        """走棋方的全部合法走法
+
+        Returns:
+            (标准走法列表, 当前变体的特殊走法列表)
+        """
+        board = game.board
+        rule = self.rule_for(game.chess_variant_state)
+        return list(board.legal_moves), list(rule.generate_special_moves(board))
+
+    def play_turn(self, game, move, stockfish):
+        """执行玩家的标准走法（必须合法）和AI的应答
+
+        Args:
+            game: GameState，调用方已持有game.lock
+            move: 玩家的chess.Move
+            stockfish: 引擎，需提供search/search_excluding/set_position/get_evaluation
+
+        Returns:
+            TurnContext
+        """
+        rule = self.rule_for(game.chess_variant_state)
+        ctx = TurnContext(game, move)
+
+        rule.pre_move(ctx)
+        self.apply_random_move(ctx, game.random_move_probability)
+        game.push_move(ctx.move)
+        rule.post_move(ctx)
+
+        game.sync_engine(stockfish)
+        ctx.search_result = rule.search(ctx, stockfish)
+        ctx.ai_move = ctx.search_result['bestmove']
+        if ctx.ai_move and not ctx.skip_ai_move:
+            ai_move = chess.Move.from_uci(ctx.ai_move)
+            ctx.ai_to_square = ai_move.to_square
+            ctx.captured_by_ai = ctx.board.piece_at(ai_move.to_square)
+            game.push_move(ai_move)
+            ctx.ai_move_applied = True
+        rule.post_ai(ctx)
+        if ctx.effect is None:
+            # 没有触发任何特殊效果，AI回合结束后重置额外回合标志
+            game.is_bonus_move_round = False
+            game.bonus_move_piece_square = None
+
+        # 局面没有被变体效果额外修改时，直接使用AI搜索得到的分数
+        if ctx.board_edited or not ctx.ai_move_applied:
+            game.sync_engine(stockfish)
+            ctx.evaluation = stockfish.get_evaluation()
+        else:
+            ctx.evaluation = ctx.search_result['evaluation']
+
+        self.log_turn(ctx)
+        return ctx
+
+    def apply_random_move(self, ctx, probability):
+        """随机走位: 按概率把玩家的走法换成同一棋子的另一个合法走法"""
+        if ctx.rng.random() >= probability:
+            return
+        requested = ctx.requested_move
+        others = [
+            m for m in ctx.board.generate_legal_moves(from_mask=chess.BB_SQUARES[requested.from_square])
+            if m != requested
+        ]
+        if not others:
+            return
+        ctx.move = ctx.rng.choice(others)
+        ctx.random_move_applied = True
+        ctx.random_move_msg = (f"随机走法已触发! 棋子从{chess.square_name(ctx.move.from_square)}移动到了"
+                               f"{chess.square_name(ctx.move.to_square)}而不是玩家选择的{chess.square_name(requested.to_square)}")
+        print(f"随机走法触发: 原始走法 {requested.uci()}, 实际执行 {ctx.move.uci()}", file=sys.stderr)
+
+    def log_turn(self, ctx):
+        """记录本回合的走法和变体效果，评估记在本回合最后一步走法上"""
+        game = ctx.game
+        if game.move_log is None:
+            return
+        requested = ctx.requested_move
+        if ctx.random_move_applied:
+            # 记录玩家原本选择的目标格（和升变棋子），回放时据此重现随机走位
+            game.log_move(ctx.move, move_log.FLAG_RANDOM,
+                          evaluation=None if ctx.ai_move_applied else ctx.evaluation,
+                          square=requested.to_square,
+                          piece=chess.Piece(requested.promotion, ctx.player_color) if requested.promotion else None)
+        else:
+            game.log_move(ctx.move, evaluation=None if ctx.ai_move_applied else ctx.evaluation)
+        if ctx.ai_move_applied:
+            game.log_move(ctx.ai_move, move_log.FLAG_AI | ctx.ai_log_flags, ctx.evaluation, square=ctx.ai_log_square)
+        if ctx.bonus_square is not None:
+            game.log_move(flags=move_log.FLAG_BONUS, square=ctx.bonus_square)
+        if ctx.transform_square is not None:
+            game.log_move(flags=move_log.FLAG_TRANSFORM, square=ctx.transform_square,
+                          piece=ctx.board.piece_at(ctx.transform_square))
+
+    def response(self, ctx):
+        """play_turn结果对应的 /move 响应（不含search_info）"""
+        game = ctx.game
+        response = {
+            'status': 'success',
+            'fen': ctx.board.fen(),
+            'ai_move': ctx.ai_move,
+            'evaluation': ctx.evaluation,
+            'variant_state': game.chess_variant_state,
+        }
+        if ctx.random_move_applied:
+            response['random_move_applied'] = True
+            response['original_move'] = ctx.requested_move.uci()
+            response['actual_move'] = ctx.move.uci()
+            response['random_move_msg'] = ctx.random_move_msg
+
+        if ctx.effect is not None:
+            self.rule_for(game.chess_variant_state).annotate(ctx, response)
+
+        if ctx.transform_square is not None:
+            response['special_effect'] = 'transform'
+            response['special_effect_msg'] = ctx.transform_msg
+            response['transform_piece_square'] = chess.square_name(ctx.transform_square)
+            response['transform_count'] = game.variant_g_transform_count
+            response['transform_max'] = TransformRule.max_transforms
+        return response
+
+    def play_special_move(self, game, from_square, to_square, stockfish):
+        """variant_move请求: 按当前变体的特殊走法移动棋子，然后由AI应答
+
+        Returns:
+            响应字典（不含search_info）和搜索结果；不符合变体规则时返回 (None, None)
+        """
+        board = game.board
+        rule = self.rule_for(game.chess_variant_state)
+        actual_to = rule.special_move_target(board, chess.Move(from_square, to_square), game.rng)
+        if actual_to is None:
+            return None, None
+
+        game.apply_manual_move(from_square, actual_to)
+        player_flags = move_log.FLAG_VARIANT_MOVE
+        if actual_to != to_square:
+            player_flags |= move_log.FLAG_RANDOM
+        game.log_move(chess.Move(from_square, actual_to), player_flags,
+                      square=to_square if actual_to != to_square else None)
+
+        # 引擎给出的是标准走法，合法时按标准规则执行（易位、升变、吃过路兵，并进入走法历史），
+        # 只有在变体局面下不合法时才直接移动棋子
+        game.sync_engine(stockfish)
+        search_result = stockfish.search()
+        ai_move = search_result['bestmove']
+        ai_log_flags = None
+        if ai_move:
+            ai = chess.Move.from_uci(ai_move)
+            if board.is_legal(ai):
+                game.push_move(ai)
+                ai_log_flags = move_log.FLAG_AI
+            elif game.apply_manual_move(ai.from_square, ai.to_square) is not None:
+                ai_log_flags = move_log.FLAG_AI | move_log.FLAG_VARIANT_MOVE
+            else:
+                print(f"AI走法执行失败: {ai_move}", file=sys.stderr)
+
+        evaluation = search_result['evaluation']
+        if ai_log_flags is not None:
+            game.log_move(ai_move, ai_log_flags, evaluation)
+
+        response = {
+            'status': 'success',
+            'fen': board.fen(),
+            'ai_move': ai_move,
+            'evaluation': evaluation,
+            'variant_state': game.chess_variant_state,
+            'message': '特殊变体走法成功'
+        }
+        if actual_to != to_square:
+            original_to = chess.square_name(to_square)
+            actual_to_name = chess.square_name(actual_to)
+            response['random_move_applied'] = True
+            response['original_move'] = chess.square_name(from_square) + original_to
+            response['actual_move'] = chess.square_name(from_square) + actual_to_name
+            response['random_move_msg'] = f"随机走法已触发! 棋子移动到了 {actual_to_name} 而不是玩家选择的目标位置 {original_to}"
+        return response, search_result
@@ -0,0 +1,275 @@
+"""
+异步写入队列
+请求处理中只把资料和比赛记录放进队列，由后台线程按批写入DataStore（一个事务一批），
+进程退出时把队列中剩余的记录写完
+"""
+
+import copy
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+_CLOSE = object()
+
+# 有写入失败的记录时，队列空闲多久后单独重写一次（秒）
+RETRY_INTERVAL = 5
+
+# 数据库暂时不可用（被锁、磁盘错误等）的异常，只有这些错误会重试；其他错误说明记录本身无法写入
+TRANSIENT_ERRORS = (sqlite3.OperationalError,)
+
+
+class WriteBehindQueue:
+    """DataStore前面的写入队列，读取资料时会先查还没写入的记录"""
+
+    def __init__(self, store, batch_size=200, flush_interval=0.2, max_pending=10000, retries=3):
+        """
+        Args:
+            store: DataStore
+            batch_size: 每个事务最多写入的记录数
+            flush_interval: 收到第一条记录后最多等待多久凑成一批（秒）
+            max_pending: 队列上限，队列满时请求线程直接同步写入；也是等待重写的失败记录上限
+            retries: 数据库暂时不可用时每批的重试次数，全部失败后这批记录并入下一批再写
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.max_pending = max_pending
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        # 还没写入的用户资料，保证 /twitter_info 之后的 /set_side 能读到刚保存的评级
+        self._pending_profiles = {}
+        # 重试全部失败、等待并入下一批写入的记录，资料按用户名去重
+        self._failed_profiles = {}
+        self._failed_matches = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.enqueued = 0
+        self.batches = 0
+        self.records_written = 0
+        self.largest_batch = 0
+        self.sync_writes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.quarantined = 0
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def put_profile(self, username, data):
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._pending_profiles[username.lower()] = data
+        self._enqueue(('profile', username, data))
+
+    def add_match(self, match):
+        self._enqueue(('match', copy.deepcopy(match)))
+
+    def get_profile(self, username):
+        with self._lock:
+            data = self._pending_profiles.get(username.lower())
+        if data is not None:
+            return copy.deepcopy(data)
+        return self.store.get_profile(username)
+
+    def _enqueue(self, item):
+        if self._closed:
+            self._write([item])
+            return
+        try:
+            self._queue.put_nowait(item)
+            self.enqueued += 1
+        except queue.Full:
+            # 后台线程跟不上时退回同步写入，不丢记录
+            self.sync_writes += 1
+            self._write([item])
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=RETRY_INTERVAL if self._has_failed() else None)
+            except queue.Empty:
+                self._write([])
+                continue
+            if item is _CLOSE:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            closing = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+            for _ in range(len(batch) + closing):
+                self._queue.task_done()
+            if closing:
+                return
+
+    def _write(self, batch):
+        with self._lock:
+            # 上一次写入失败的记录排在本批前面，本批中同一用户更新的资料覆盖旧的
+            profiles = self._failed_profiles
+            matches = self._failed_matches
+            self._failed_profiles = {}
+            self._failed_matches = []
+        for item in batch:
+            if item[0] == 'profile':
+                profiles[item[1].lower()] = (item[1], item[2])
+            else:
+                matches.append(item[1])
+        profiles = list(profiles.values())
+        count = len(profiles) + len(matches)
+        if not count:
+            return
+
+        error = self._write_batch(profiles, matches)
+        if error is None:
+            written, failed = (profiles, matches), ([], [])
+        elif isinstance(error, TRANSIENT_ERRORS):
+            written, failed = ([], []), (profiles, matches)
+        else:
+            # 某条记录本身无法写入（缺少字段、无法序列化等），整批重写会一直失败，改为逐条写入找出这些记录
+            print(f"批量写入失败，逐条重写 {count} 条记录: {error!r}", file=sys.stderr)
+            written, failed = self._write_each(profiles, matches)
+
+        with self._lock:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, count)
+            self.records_written += len(written[0]) + len(written[1])
+            # 只移除已经写入的那份资料，期间又有新资料入队时保留新的
+            for username, data in written[0]:
+                key = username.lower()
+                if self._pending_profiles.get(key) is data:
+                    del self._pending_profiles[key]
+            self._keep_failed(*failed)
+
+    def _write_batch(self, profiles, matches):
+        """在一个事务中写入，只重试数据库暂时不可用的错误
+
+        Returns:
+            None表示写入成功，否则为最后一次的异常
+        """
+        for attempt in range(self.retries):
+            try:
+                self.store.write_batch(profiles=profiles, matches=matches)
+                return None
+            except TRANSIENT_ERRORS as e:
+                error = e
+                print(f"写入数据库失败（第 {attempt + 1} 次）: {e}", file=sys.stderr)
+                if attempt + 1 < self.retries:
+                    time.sleep(0.1 * (2 ** attempt))
+            except Exception as e:
+                return e
+        return error
+
+    def _write_each(self, profiles, matches):
+        """每条记录单独一个事务写入，始终无法写入的记录被隔离
+
+        Returns:
+            (写入的记录, 数据库暂时不可用而需要重写的记录)，各为 (资料列表, 比赛记录列表)
+        """
+        written = ([], [])
+        failed = ([], [])
+        records = [(0, profile) for profile in profiles] + [(1, match) for match in matches]
+        for index, (kind, record) in enumerate(records):
+            error = self._write_batch([record] if kind == 0 else [], [record] if kind == 1 else [])
+            if error is None:
+                written[kind].append(record)
+            elif isinstance(error, TRANSIENT_ERRORS):
+                # 数据库不可用时剩下的记录也写不进去，一起等下次重写
+                for remaining_kind, remaining in records[index:]:
+                    failed[remaining_kind].append(remaining)
+                break
+            else:
+                self._quarantine(kind, record, error)
+        return written, failed
+
+    def _quarantine(self, kind, record, error):
+        """隔离无法写入的记录: 写入日志后丢弃，不再重写，也不会阻塞之后的写入"""
+        with self._lock:
+            if kind == 0:
+                username, data = record
+                key = username.lower()
+                if self._pending_profiles.get(key) is data:
+                    del self._pending_profiles[key]
+            self.quarantined += 1
+        print(f"记录无法写入，已隔离: {error!r} {str(record)[:200]}", file=sys.stderr)
+
+    def _keep_failed(self, profiles, matches):
+        """数据库暂时不可用时保留记录，并入下一批重写；调用方持有self._lock"""
+        if not profiles and not matches:
+            return
+        # 资料留在_pending_profiles中，读取仍能看到
+        count = len(profiles) + len(matches)
+        self.failures += count
+        for username, data in profiles:
+            self._failed_profiles.setdefault(username.lower(), (username, data))
+        self._failed_matches = matches + self._failed_matches
+        overflow = len(self._failed_profiles) + len(self._failed_matches) - self.max_pending
+        if overflow > 0:
+            # 数据库长时间不可用时只保留最新的记录，先丢弃最早的比赛记录
+            dropped_matches = min(overflow, len(self._failed_matches))
+            del self._failed_matches[:dropped_matches]
+            for key in list(self._failed_profiles)[:overflow - dropped_matches]:
+                username, data = self._failed_profiles.pop(key)
+                if self._pending_profiles.get(key) is data:
+                    del self._pending_profiles[key]
+            self.dropped += overflow
+            print(f"写入失败的记录过多，丢弃 {overflow} 条", file=sys.stderr)
+        else:
+            print(f"{count} 条记录写入失败，将并入下一批重写", file=sys.stderr)
+
+    def _has_failed(self):
+        with self._lock:
+            return bool(self._failed_profiles or self._failed_matches)
+
+    def flush(self):
+        """等待队列中已有的记录全部写入"""
+        self._queue.join()
+
+    def close(self, timeout=10):
+        """停止接收新记录，写完队列中剩余的记录后结束后台线程"""
+        if self._closed:
+            return
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        try:
+            # 队列满时同样只等待timeout，进程退出不会卡在这里
+            self._queue.put(_CLOSE, timeout=timeout)
+        except queue.Full:
+            print("写入队列在关闭时没有按时写完", file=sys.stderr)
+            return
+        self._thread.join(max(0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            print("写入队列在关闭时没有按时写完", file=sys.stderr)
+            return
+        if self._has_failed():
+            # 最后再尝试一次写入之前失败的记录
+            self._write([])
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'batches': self.batches,
+            'records_written': self.records_written,
+            'largest_batch': self.largest_batch,
+            'sync_writes': self.sync_writes,
+            'failures': self.failures,
+            'retry_pending': len(self._failed_profiles) + len(self._failed_matches),
+            'dropped': self.dropped,
+            'quarantined': self.quarantined,
+        }